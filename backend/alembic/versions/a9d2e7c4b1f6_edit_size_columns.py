@@ -0,0 +1,44 @@
+"""edit size columns
+
+Revision ID: a9d2e7c4b1f6
+Revises: f3c6d1a8b4e9
+Create Date: 2026-10-14 19:24:06.391528
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9d2e7c4b1f6'
+down_revision: Union[str, Sequence[str], None] = 'f3c6d1a8b4e9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = ('data_size_bytes', 'voxels_modified')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    # segmentation_edits is created by the app on startup, so it may not exist yet
+    if not inspector.has_table('segmentation_edits'):
+        return
+    existing = {column['name'] for column in inspector.get_columns('segmentation_edits')}
+    # Existing rows stay NULL; both are informational and only set on new edits
+    for name in COLUMNS:
+        if name not in existing:
+            op.add_column('segmentation_edits', sa.Column(name, sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('segmentation_edits'):
+        return
+    existing = {column['name'] for column in inspector.get_columns('segmentation_edits')}
+    for name in COLUMNS:
+        if name in existing:
+            op.drop_column('segmentation_edits', name)
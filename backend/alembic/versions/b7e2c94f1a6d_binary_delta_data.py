@@ -0,0 +1,47 @@
+"""binary delta data
+
+Revision ID: b7e2c94f1a6d
+Revises: 9c41e7a2d5b3
+Create Date: 2026-10-14 15:02:17.418230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e2c94f1a6d'
+down_revision: Union[str, Sequence[str], None] = '9c41e7a2d5b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # segmentation_edits is created by the app on startup, so it may not exist yet
+    if not sa.inspect(op.get_bind()).has_table('segmentation_edits'):
+        return
+    # Existing text deltas are kept as their UTF-8 bytes; decode_delta still reads them
+    op.alter_column(
+        'segmentation_edits', 'delta_data',
+        existing_type=sa.Text(),
+        type_=sa.LargeBinary(),
+        existing_nullable=True,
+        postgresql_using="convert_to(delta_data, 'UTF8')"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not sa.inspect(op.get_bind()).has_table('segmentation_edits'):
+        return
+    # Only text deltas survive the downgrade - binary deltas must be removed first
+    op.alter_column(
+        'segmentation_edits', 'delta_data',
+        existing_type=sa.LargeBinary(),
+        type_=sa.Text(),
+        existing_nullable=True,
+        postgresql_using="convert_from(delta_data, 'UTF8')"
+    )
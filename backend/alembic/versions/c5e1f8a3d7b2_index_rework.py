@@ -0,0 +1,79 @@
+"""index rework
+
+Revision ID: c5e1f8a3d7b2
+Revises: a9d2e7c4b1f6
+Create Date: 2026-10-14 20:12:45.907133
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5e1f8a3d7b2'
+down_revision: Union[str, Sequence[str], None] = 'a9d2e7c4b1f6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (table, name, columns, options) for the indexes the models now declare
+NEW_INDEXES = [
+    ('project_collaborators', 'ix_collab_project_user', ['project_id', 'user_id'], {'unique': True}),
+    ('segmentations', 'ix_segmentations_project_updated', ['project_id', 'updated_at'], {}),
+    ('segmentation_edits', 'ix_segmentation_edits_type_lookup',
+     ['segmentation_id', 'edit_type', sa.text('created_at DESC')], {}),
+    ('segmentation_edits', 'ix_edits_created_brin', ['created_at'], {'postgresql_using': 'brin'}),
+    ('segmentation_edits', 'ix_session_replay', ['session_id', 'created_at'],
+     {'postgresql_include': ['segmentation_id', 'edit_type', 'file_path']}),
+    ('segmentation_edits', 'ix_session_edits_by_type',
+     ['session_id', 'segmentation_id', 'edit_type', sa.text('created_at DESC')], {}),
+]
+
+# Indexes create_all made from the old models, which the ones above (or the
+# primary keys) now cover
+OLD_INDEXES = [
+    ('projects', 'ix_projects_id', ['id']),
+    ('segmentations', 'ix_segmentations_project_id', ['project_id']),
+    ('segmentation_edits', 'ix_segmentation_edits_id', ['id']),
+    ('segmentation_edits', 'ix_segmentation_edits_segmentation_id', ['segmentation_id']),
+    ('segmentation_edits', 'ix_segmentation_edits_created_at', ['created_at']),
+    ('segmentation_edits', 'ix_segmentation_edits_session_id', ['session_id']),
+    ('segmentation_edits', 'ix_session_edits', ['session_id', 'created_at']),
+    ('collaborative_sessions', 'ix_collaborative_sessions_id', ['id']),
+    ('collaborative_sessions', 'ix_collaborative_sessions_segmentation_id', ['segmentation_id']),
+]
+
+
+def _existing_indexes(inspector, table):
+    # Tables are created by the app on startup, so they may not exist yet
+    if not inspector.has_table(table):
+        return None
+    return {index['name'] for index in inspector.get_indexes(table)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    existing = {table: _existing_indexes(inspector, table)
+                for table in {spec[0] for spec in NEW_INDEXES + OLD_INDEXES}}
+    # New ones first, so queries are never left without an index
+    for table, name, columns, options in NEW_INDEXES:
+        if existing[table] is not None and name not in existing[table]:
+            op.create_index(name, table, columns, **options)
+    for table, name, _ in OLD_INDEXES:
+        if existing[table] is not None and name in existing[table]:
+            op.drop_index(name, table_name=table)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    existing = {table: _existing_indexes(inspector, table)
+                for table in {spec[0] for spec in NEW_INDEXES + OLD_INDEXES}}
+    for table, name, columns in OLD_INDEXES:
+        if existing[table] is not None and name not in existing[table]:
+            op.create_index(name, table, columns)
+    for table, name, _, _ in NEW_INDEXES:
+        if existing[table] is not None and name in existing[table]:
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,65 @@
+"""session participants
+
+Revision ID: d41f7c3e9a25
+Revises: b7e2c94f1a6d
+Create Date: 2026-10-14 16:41:09.552871
+
+"""
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41f7c3e9a25'
+down_revision: Union[str, Sequence[str], None] = 'b7e2c94f1a6d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    # collaborative_sessions is created by the app on startup, so it may not exist yet
+    if not inspector.has_table('collaborative_sessions'):
+        return
+    # The app's create_all may already have made the (empty) table - the backfill still runs
+    if inspector.has_table('session_participants'):
+        participants = sa.table(
+            'session_participants', sa.column('session_id', sa.Integer()), sa.column('user_id', sa.Integer())
+        )
+    else:
+        participants = op.create_table(
+            'session_participants',
+            sa.Column('session_id', sa.Integer(), sa.ForeignKey('collaborative_sessions.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+        )
+        op.create_index('ix_session_participants_user', 'session_participants', ['user_id'])
+
+    # Backfill from the JSON column; creators are always participants. Pairs already
+    # present (sessions started since the table appeared) are skipped
+    bind = op.get_bind()
+    existing = set(bind.execute(sa.text("SELECT session_id, user_id FROM session_participants")))
+    sessions = bind.execute(sa.text(
+        "SELECT id, started_by_id, participants_json FROM collaborative_sessions"
+    ))
+    rows = []
+    for session_id, started_by_id, participants_json in sessions:
+        user_ids = set(json.loads(participants_json or "[]")) | {started_by_id}
+        rows.extend(
+            {'session_id': session_id, 'user_id': user_id}
+            for user_id in user_ids if (session_id, user_id) not in existing
+        )
+    if rows:
+        op.bulk_insert(participants, rows)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not sa.inspect(op.get_bind()).has_table('session_participants'):
+        return
+    # participants_json is still written alongside the table, so nothing is lost
+    op.drop_index('ix_session_participants_user', table_name='session_participants')
+    op.drop_table('session_participants')
@@ -0,0 +1,42 @@
+"""edit file hash
+
+Revision ID: e8a5b0d2c7f4
+Revises: d41f7c3e9a25
+Create Date: 2026-10-14 17:58:31.204417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8a5b0d2c7f4'
+down_revision: Union[str, Sequence[str], None] = 'd41f7c3e9a25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    # segmentation_edits is created by the app on startup, so it may not exist yet
+    if not inspector.has_table('segmentation_edits'):
+        return
+    if any(column['name'] == 'file_hash' for column in inspector.get_columns('segmentation_edits')):
+        return
+    # Existing rows stay unhashed; only new saves are deduplicated
+    op.add_column('segmentation_edits', sa.Column('file_hash', sa.String(length=64), nullable=True))
+    op.create_index('ix_segmentation_edits_hash', 'segmentation_edits', ['segmentation_id', 'file_hash'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('segmentation_edits'):
+        return
+    if not any(column['name'] == 'file_hash' for column in inspector.get_columns('segmentation_edits')):
+        return
+    op.drop_index('ix_segmentation_edits_hash', table_name='segmentation_edits')
+    op.drop_column('segmentation_edits', 'file_hash')
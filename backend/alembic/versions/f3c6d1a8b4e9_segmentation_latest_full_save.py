@@ -0,0 +1,61 @@
+"""segmentation latest full save
+
+Revision ID: f3c6d1a8b4e9
+Revises: e8a5b0d2c7f4
+Create Date: 2026-10-14 18:36:52.817340
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3c6d1a8b4e9'
+down_revision: Union[str, Sequence[str], None] = 'e8a5b0d2c7f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    # segmentations/segmentation_edits are created by the app on startup, so they may not exist yet
+    if not inspector.has_table('segmentations') or not inspector.has_table('segmentation_edits'):
+        return
+    if any(column['name'] == 'latest_full_save_edit_id' for column in inspector.get_columns('segmentations')):
+        return
+    with op.batch_alter_table('segmentations') as batch_op:
+        batch_op.add_column(sa.Column('latest_full_save_edit_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('latest_full_save_path', sa.String(length=500), nullable=True))
+        batch_op.create_foreign_key(
+            'fk_segmentations_latest_full_save', 'segmentation_edits',
+            ['latest_full_save_edit_id'], ['id'], ondelete='SET NULL'
+        )
+
+    # Point every segmentation at its newest full save or snapshot
+    op.execute(
+        "UPDATE segmentations SET latest_full_save_edit_id = ("
+        " SELECT e.id FROM segmentation_edits e"
+        " WHERE e.segmentation_id = segmentations.id AND e.edit_type IN ('FULL_SAVE', 'SNAPSHOT')"
+        " ORDER BY e.created_at DESC, e.id DESC LIMIT 1)"
+    )
+    op.execute(
+        "UPDATE segmentations SET latest_full_save_path = ("
+        " SELECT e.file_path FROM segmentation_edits e WHERE e.id = segmentations.latest_full_save_edit_id)"
+        " WHERE latest_full_save_edit_id IS NOT NULL"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('segmentations'):
+        return
+    if not any(column['name'] == 'latest_full_save_edit_id' for column in inspector.get_columns('segmentations')):
+        return
+    with op.batch_alter_table('segmentations') as batch_op:
+        batch_op.drop_constraint('fk_segmentations_latest_full_save', type_='foreignkey')
+        batch_op.drop_column('latest_full_save_path')
+        batch_op.drop_column('latest_full_save_edit_id')
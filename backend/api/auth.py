@@ -1,35 +1,137 @@
-from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, status
+from sqlalchemy import exists, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
 from pydantic import BaseModel, EmailStr
-from jose import jwt
+import jwt
+from cachetools import TTLCache
 from passlib.context import CryptContext
-from database import get_db
+from database import get_db, get_async_db
 from models import User
 from email_utils import send_verification_email
+import asyncio
+import base64
+import functools
 import hashlib
+import os
 import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.security import OAuth2PasswordBearer
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-SECRET_KEY = "mysecretkey"
+# New hashes are argon2id over the raw password - no 72-byte limit, so no prehash.
+# bcrypt is kept only to verify hashes created before the switch; those are
+# replaced on the next successful login. Costs follow OWASP's argon2id baseline.
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__memory_cost=19456,
+    argon2__time_cost=2,
+    argon2__parallelism=1,
+)
+# Loaded once as bytes so signing/verifying never re-encodes the key
+SECRET_KEY = os.getenv("JWT_SECRET", "").encode("utf-8")
+if not SECRET_KEY:
+    raise RuntimeError("JWT_SECRET not set in .env")
 ALGORITHM = "HS256"
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
+# Reused decoder instance - avoids rebuilding the PyJWT object per request
+jwt_decoder = jwt.PyJWT()
+
+# Password hashing is CPU-bound; run it on its own pool so logins don't stall the event
+# loop or starve the threadpool used by sync endpoints. The semaphore caps queued work
+# so a login storm fails fast instead of piling up.
+def _available_cpus():
+    # Respect CPU affinity (e.g. a container cpuset) where the platform exposes it
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+HASH_WORKERS = min(8, _available_cpus())
+hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="pwhash")
+_hash_slots = asyncio.Semaphore(HASH_WORKERS * 2)
+
+# token digest -> (token exp or None, user column values); short TTL bounds how stale
+# a cached user can be, and entries are never served past the token's own expiry
+_token_cache = TTLCache(maxsize=10000, ttl=30)
+_token_cache_lock = threading.Lock()
+_USER_CACHE_COLUMNS = ("id", "username", "email", "password", "is_verified", "email_token")
+
+# sha256(email:password) digest -> recently failed; lets repeated bad attempts skip hashing.
+# Only touched from the event loop, so no lock is needed.
+_failed_login_cache = TTLCache(maxsize=4096, ttl=5)
 
 def generate_email_token():
     return secrets.token_urlsafe(32)
 
+# Legacy bcrypt hashes were taken over a sha256 prehash: base64 of the digest,
+# or the hexdigest for the oldest accounts
+def _legacy_prehash(password: str):
+    return base64.b64encode(hashlib.sha256(password.encode("utf-8")).digest()).decode("ascii")
+
+def _legacy_hex_prehash(password: str):
+    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+
 def hash_password(password: str):
-    prehashed = hashlib.sha256(password.encode("utf-8")).hexdigest()
-    return pwd_context.hash(prehashed)
+    return pwd_context.hash(password)
+
+def verify_and_update_password(plain_password: str, hashed_password: str):
+    """
+    Verify a password and return (is_valid, new_hash).
+    new_hash is set when the stored hash is a legacy bcrypt hash
+    or uses outdated argon2 settings and should be replaced.
+    """
+    if pwd_context.identify(hashed_password, required=False) == "bcrypt":
+        if (pwd_context.verify(_legacy_prehash(plain_password), hashed_password)
+                or pwd_context.verify(_legacy_hex_prehash(plain_password), hashed_password)):
+            return True, hash_password(plain_password)
+        return False, None
+    return pwd_context.verify_and_update(plain_password, hashed_password)
 
 def verify_password(plain_password: str, hashed_password: str):
-    prehashed = hashlib.sha256(plain_password.encode("utf-8")).hexdigest()
-    return pwd_context.verify(prehashed, hashed_password)
+    return verify_and_update_password(plain_password, hashed_password)[0]
+
+async def _run_password_hash(func, *args):
+    if _hash_slots.locked():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    async with _hash_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(hash_executor, func, *args)
+
+async def hash_password_async(password: str):
+    return await _run_password_hash(hash_password, password)
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str):
+    return await _run_password_hash(verify_and_update_password, plain_password, hashed_password)
+
+@functools.lru_cache(maxsize=1)
+def _dummy_password_hash():
+    # Verified against when the email is unknown, so both paths cost one hash
+    return hash_password(secrets.token_urlsafe(32))
+
+def _verify_dummy_password(plain_password: str):
+    return verify_password(plain_password, _dummy_password_hash())
+
+def _login_attempt_key(email: str, password: str):
+    return hashlib.sha256(f"{email}:{password}".encode("utf-8")).digest()[:16]
 
 def create_access_token(data: dict):
     return jwt.encode(data, SECRET_KEY, algorithm=ALGORITHM)
 
+def verify_token(token: str) -> dict:
+    """Decode and verify a JWT, raising jwt.PyJWTError if it is invalid"""
+    return jwt_decoder.decode(
+        token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_aud": False}
+    )
+
 class RegisterRequest(BaseModel):
     username: str
     email: EmailStr
@@ -40,27 +142,53 @@ class LoginRequest(BaseModel):
     password: str
 
 @router.post("/register")
-def register(request: RegisterRequest, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.username == request.username).first():
+async def register(request: RegisterRequest, background_tasks: BackgroundTasks,
+                   db: AsyncSession = Depends(get_async_db)):
+    # Two index-only EXISTS probes in one round-trip
+    result = await db.execute(select(
+        exists().where(User.username == request.username),
+        exists().where(User.email == request.email),
+    ))
+    username_taken, email_taken = result.one()
+    if username_taken:
         raise HTTPException(status_code=400, detail="Username already exists")
-    if db.query(User).filter(User.email == request.email).first():
+    if email_taken:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_pw = hash_password(request.password)
+    hashed_pw = await hash_password_async(request.password)
     token = generate_email_token()
     new_user = User(username=request.username, email=request.email, password=hashed_pw,
                     email_token=token, is_verified=False)
-    #send_verification_email(new_user.email, token)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent registration won the race past the EXISTS check
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Username or email already registered")
+    # SMTP runs in the threadpool after the response is sent
+    background_tasks.add_task(send_verification_email, new_user.email, token)
     return {"message": f"User '{request.username}' registered successfully!"}
 
 @router.post("/login")
-def login(request: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == request.email).first()
-    if not user or not verify_password(request.password, user.password):
+async def login(request: LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    attempt_key = _login_attempt_key(request.email, request.password)
+    if attempt_key in _failed_login_cache:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+
+    result = await db.execute(select(User).where(User.email == request.email))
+    user = result.scalar_one_or_none()
+    if not user:
+        await _run_password_hash(_verify_dummy_password, request.password)
+        _failed_login_cache[attempt_key] = True
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    valid, new_hash = await verify_and_update_password_async(request.password, user.password)
+    if not valid:
+        _failed_login_cache[attempt_key] = True
         raise HTTPException(status_code=401, detail="Invalid email or password")
+    if new_hash:
+        user.password = new_hash
+        await db.commit()
     if not user.is_verified:
         raise HTTPException(status_code=403, detail="Please verify your email")
 
@@ -84,21 +212,40 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     """
     Dependency to get the currently authenticated user from JWT token
     """
+    cache_key = hashlib.sha256(token.encode("utf-8")).digest()[:16]
+    with _token_cache_lock:
+        cached = _token_cache.get(cache_key)
+        if cached is not None and cached[0] is not None and cached[0] <= time.time():
+            # Expired since it was cached - drop it and let verify_token reject it
+            del _token_cache[cache_key]
+            cached = None
+    if cached is not None:
+        # Re-attach a detached copy to this request's session without a SELECT
+        user = User(**cached[1])
+        make_transient_to_detached(user)
+        return db.merge(user, load=False)
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = verify_token(token)
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
-    except JWTError:
+    except jwt.PyJWTError:
         raise credentials_exception
 
     user = db.query(User).filter(User.email == email).first()
     if user is None:
         raise credentials_exception
 
+    with _token_cache_lock:
+        _token_cache[cache_key] = (
+            payload.get("exp"),
+            {col: getattr(user, col) for col in _USER_CACHE_COLUMNS},
+        )
+
     return user
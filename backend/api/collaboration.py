@@ -1,29 +1,131 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query, HTTPException, status
-from typing import Dict, Set, List, Optional
+from typing import Dict, Set, List, NamedTuple, Optional, Counter, KeysView, Tuple
+from collections import defaultdict
+from itertools import count, groupby
+from operator import attrgetter
 import json
 import asyncio
+import logging
+import anyio
+import uuid
+import orjson
+from redis import RedisError
 from datetime import datetime
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from pydantic import BaseModel, Field
 
-from database import get_db
-from models import User, CollaborativeSession, SessionStatus
-from .auth import get_current_user
+from database import get_db, SessionLocal
+from redis_client import get_redis, invalidate_segmentation
+from models import User, Project, CollaborativeSession, SessionStatus, Segmentation
+from .auth import get_current_user, verify_token
 from services.session_service import SessionService
 from services.segmentation_service import SegmentationService
+from services.delta_manager import DeltaManager
 from services.permission_service import PermissionService
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/collaboration", tags=["Collaboration"])
 
+class PendingDelta(NamedTuple):
+    """A delta received over the WebSocket, waiting for the session's writer"""
+    segmentation_id: int
+    user_id: int
+    delta: dict
+
+
+def _write_delta_batch(session_id: int, pending: List[PendingDelta]) -> Tuple[Optional[int], bool]:
+    """
+    Persist a batch of queued deltas on a dedicated DB session
+    
+    Each run of consecutive deltas from the same user (a brush stroke) is
+    composed into a single edit first, so a stroke is one row, not hundreds.
+    
+    Returns the project ID and whether the session is due a snapshot, which
+    the caller creates in the background rather than holding up the queue.
+    """
+    db = SessionLocal()
+    try:
+        service = SegmentationService(db)
+        edits = [
+            service.build_delta_edit(
+                segmentation_id=segmentation_id,
+                delta=DeltaManager.compose_deltas([item.delta for item in run]),
+                user_id=user_id,
+                session_id=session_id
+            )
+            for (segmentation_id, user_id), run in (
+                (key, list(group)) for key, group in
+                groupby(pending, key=attrgetter("segmentation_id", "user_id"))
+            )
+        ]
+        project_id = service.save_delta_edits(edits, check_snapshot=False)
+        last = edits[-1]
+        due = bool(last.session_id) and service.snapshot_due(
+            last.segmentation_id, last.session_id, new_deltas=len(edits)
+        )
+        return project_id, due
+    finally:
+        db.close()
+
+
+def _create_snapshot(segmentation_id: int, session_id: int, user_id: int):
+    """Create a session snapshot on a dedicated DB session"""
+    db = SessionLocal()
+    try:
+        SegmentationService(db).create_snapshot(segmentation_id, session_id, user_id)
+    finally:
+        db.close()
+
+
 class ConnectionManager:
     """
     Manages WebSocket connections for collaborative sessions
+    
+    When Redis is configured, broadcasts are published to a per-session channel
+    and every worker relays them to its own sockets, so sessions can span
+    multiple processes/hosts. Otherwise fan-out stays in-process.
+    
+    Each worker writes the deltas its own sockets receive, so ending a session
+    asks every worker over CONTROL_CHANNEL to flush it first; the writer's
+    session check refuses anything that still arrives after the end.
     """
+    # Max deltas written per commit, and how long an idle writer waits before exiting
+    DELTA_BATCH_SIZE = 128
+    DELTA_WRITER_IDLE_SECONDS = 5
+    # How long a writer lets deltas gather after the first one, so a stroke is written as one edit
+    DELTA_COMPOSE_SECONDS = 0.05
+    # Attempts at writing a batch before its deltas are given up on, and the backoff between them
+    DELTA_WRITE_ATTEMPTS = 3
+    DELTA_RETRY_SECONDS = 0.5
+    # How long a socket's outgoing delta broadcasts are held so a burst goes out as one frame
+    DELTA_CORK_SECONDS = 0.02
+    # Channel every subscribed worker listens on for session-wide requests
+    CONTROL_CHANNEL = "sessions:control"
+    # How long ending a session waits for the other workers to flush it
+    FLUSH_TIMEOUT_SECONDS = 10
+    
     def __init__(self):
         # session_id -> set of websockets
         self.active_connections: Dict[int, Set[WebSocket]] = {}
         # websocket -> user_id mapping
         self.user_mapping: Dict[WebSocket, int] = {}
+        # session_id -> user_id -> number of open connections
+        self.session_users: Dict[int, Counter[int]] = defaultdict(Counter)
+        # session_id -> pending deltas, drained by one writer task per session
+        self.delta_queues: Dict[int, asyncio.Queue] = {}
+        self.delta_writers: Dict[int, asyncio.Task] = {}
+        self.delta_seq: Dict[int, count] = {}
+        # Sessions being ended: their queued deltas are flushed and new ones refused
+        self.closing_sessions: Set[int] = set()
+        # session_id -> snapshot being created; one at a time, later triggers coalesce into it
+        self.snapshot_tasks: Dict[int, asyncio.Task] = {}
+        # websocket -> delta broadcasts held by cork_delta until the next flush
+        self.delta_outbox: Dict[WebSocket, List[dict]] = {}
+        # Redis fan-out: this worker's id, its pub/sub connection and relay task
+        self.instance_id = uuid.uuid4().hex
+        self.pubsub = None
+        self.listener: Optional[asyncio.Task] = None
     
     async def connect(self, websocket: WebSocket, session_id: int, user_id: int):
         """Accept and register a new connection"""
@@ -31,60 +133,423 @@ class ConnectionManager:
         
         if session_id not in self.active_connections:
             self.active_connections[session_id] = set()
+            # First local socket for this session - start receiving its broadcasts
+            await self._subscribe(session_id)
         
-        self.active_connections[session_id].add(websocket)
+        if websocket not in self.active_connections[session_id]:
+            self.active_connections[session_id].add(websocket)
+            self.session_users[session_id][user_id] += 1
+            await self._track_user(session_id, user_id, 1)
         self.user_mapping[websocket] = user_id
     
     def disconnect(self, websocket: WebSocket, session_id: int):
         """Remove a connection"""
+        user_id = self.user_mapping.get(websocket)
+        
         if session_id in self.active_connections:
+            if websocket in self.active_connections[session_id] and user_id is not None:
+                users = self.session_users[session_id]
+                users[user_id] -= 1
+                asyncio.create_task(self._track_user(session_id, user_id, -1))
+                if users[user_id] <= 0:
+                    del users[user_id]
+                if not users:
+                    del self.session_users[session_id]
             self.active_connections[session_id].discard(websocket)
             if not self.active_connections[session_id]:
                 del self.active_connections[session_id]
+                self.closing_sessions.discard(session_id)
+                if self.pubsub is not None:
+                    asyncio.create_task(self._unsubscribe(session_id))
         
         if websocket in self.user_mapping:
             del self.user_mapping[websocket]
     
     async def broadcast(self, session_id: int, message: dict, exclude: WebSocket = None):
         """Broadcast message to all connections in a session"""
+        # Serialize once for all recipients
+        payload = orjson.dumps(message)
+        exclude_id = id(exclude) if exclude is not None else None
+        
+        redis = get_redis()
+        if redis is not None:
+            # Every subscribed worker (including this one) relays it locally.
+            # Frame is "<routing header>\n<payload>"; orjson never emits a raw newline.
+            header = orjson.dumps({"origin": self.instance_id, "exclude": exclude_id})
+            try:
+                await redis.publish(self._channel(session_id), header + b"\n" + payload)
+                return
+            except RedisError as e:
+                # Other workers miss it, but this worker's sockets still get it
+                logger.warning(f"Redis publish failed for session {session_id}, delivering locally: {e}")
+        
+        await self._local_broadcast(session_id, payload, exclude_id)
+    
+    async def _local_broadcast(self, session_id: int, payload: bytes, exclude_id: Optional[int] = None):
+        """Send a serialized message to this worker's connections in a session"""
         if session_id not in self.active_connections:
             return
         
-        dead_connections = set()
-        for connection in self.active_connections[session_id]:
-            if connection == exclude:
-                continue
-            try:
-                await connection.send_json(message)
-            except Exception:
-                dead_connections.add(connection)
+        # Send to everyone concurrently so one slow client doesn't hold up the rest
+        connections = [
+            connection for connection in self.active_connections[session_id]
+            if id(connection) != exclude_id
+        ]
+        results = await asyncio.gather(
+            *(connection.send_bytes(payload) for connection in connections),
+            return_exceptions=True
+        )
         
         # Clean up dead connections
-        for connection in dead_connections:
-            self.disconnect(connection, session_id)
+        for connection, result in zip(connections, results):
+            if isinstance(result, Exception):
+                self.disconnect(connection, session_id)
+    
+    @staticmethod
+    def _channel(session_id: int) -> str:
+        return f"session:{session_id}"
+    
+    @staticmethod
+    def _users_key(session_id: int) -> str:
+        return f"session:{session_id}:users"
+    
+    async def _track_user(self, session_id: int, user_id: int, step: int):
+        """Count a user's connections in Redis, so every worker sees who is in a session"""
+        redis = get_redis()
+        if redis is None:
+            return
+        try:
+            await redis.hincrby(self._users_key(session_id), str(user_id), step)
+        except RedisError as e:
+            logger.warning(f"Failed to update active users for session {session_id}: {e}")
+    
+    async def get_active_users(self, session_id: int) -> List[int]:
+        """
+        Get the IDs of users connected to a session on any worker
+        Falls back to this worker's own connections without Redis
+        """
+        redis = get_redis()
+        if redis is not None:
+            try:
+                counts = await redis.hgetall(self._users_key(session_id))
+                return [int(user_id) for user_id, n in counts.items() if int(n) > 0]
+            except RedisError as e:
+                logger.warning(f"Failed to read active users for session {session_id}: {e}")
+        return list(self.get_session_users(session_id))
+    
+    async def _subscribe(self, session_id: int):
+        """Subscribe this worker to a session's channel"""
+        redis = get_redis()
+        if redis is None:
+            return
+        
+        try:
+            if self.pubsub is None:
+                pubsub = redis.pubsub()
+                # Kept for the worker's lifetime, so flush requests reach every worker that ever had deltas
+                await pubsub.subscribe(self.CONTROL_CHANNEL)
+                self.pubsub = pubsub
+            await self.pubsub.subscribe(self._channel(session_id))
+        except RedisError as e:
+            # The session still works on this worker; broadcasts fall back to local delivery
+            logger.warning(f"Redis subscribe failed for session {session_id}: {e}")
+            return
+        
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.create_task(self._listen())
+    
+    async def _unsubscribe(self, session_id: int):
+        """Drop a session's channel once its last local socket has left"""
+        if session_id in self.active_connections:
+            return  # someone rejoined in the meantime
+        try:
+            await self.pubsub.unsubscribe(self._channel(session_id))
+        except Exception as e:
+            logger.warning(f"Redis unsubscribe failed for session {session_id}: {e}")
+    
+    async def _listen(self):
+        """Relay messages published on subscribed channels to local sockets"""
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except Exception:
+                logger.exception("Redis pub/sub read failed")
+                await asyncio.sleep(1)
+                continue
+            
+            if message is None:
+                continue
+            
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            if channel == self.CONTROL_CHANNEL:
+                # Flushing waits on the writer, so it mustn't hold up relaying
+                asyncio.create_task(self._handle_control(orjson.loads(message["data"])))
+                continue
+            session_id = int(channel.split(":", 1)[1])
+            
+            header, payload = message["data"].split(b"\n", 1)
+            header = orjson.loads(header)
+            # Socket ids are only meaningful on the worker that published
+            exclude_id = header["exclude"] if header["origin"] == self.instance_id else None
+            await self._local_broadcast(session_id, payload, exclude_id)
     
     async def send_personal(self, websocket: WebSocket, message: dict):
         """Send message to a specific connection"""
         try:
-            await websocket.send_json(message)
+            await websocket.send_bytes(orjson.dumps(message))
         except Exception:
             pass
     
-    def get_session_users(self, session_id: int) -> Set[int]:
-        """Get all user IDs in a session"""
-        if session_id not in self.active_connections:
-            return set()
+    def cork_delta(self, session_id: int, websocket: WebSocket, message: dict):
+        """
+        Queue a delta broadcast from a socket, coalescing bursts into one frame
+        
+        Deltas queued within DELTA_CORK_SECONDS of the first pending one are
+        broadcast together as a single "delta_batch" message carrying them in
+        order; a lone delta still goes out as a plain "delta" message.
+        """
+        outbox = self.delta_outbox.get(websocket)
+        if outbox is None:
+            outbox = self.delta_outbox[websocket] = []
+            asyncio.create_task(self._flush_deltas(session_id, websocket))
+        outbox.append(message)
+    
+    async def _flush_deltas(self, session_id: int, websocket: WebSocket):
+        """Broadcast a socket's corked deltas once the cork window has passed"""
+        await asyncio.sleep(self.DELTA_CORK_SECONDS)
+        messages = self.delta_outbox.pop(websocket, [])
+        if not messages:
+            return
+        
+        message = messages[0] if len(messages) == 1 else {"type": "delta_batch", "deltas": messages}
+        try:
+            await self.broadcast(session_id, message, exclude=websocket)
+        except Exception:
+            logger.exception(f"Delta broadcast failed for session {session_id}")
+    
+    def enqueue_delta(self, session_id: int, segmentation_id: int, user_id: int, delta: dict) -> int:
+        """
+        Queue a delta for the session's background writer
         
-        users = set()
-        for connection in self.active_connections[session_id]:
-            if connection in self.user_mapping:
-                users.add(self.user_mapping[connection])
-        return users
+        The delta should already have "voxels" columns (DeltaManager.create_delta).
+        
+        Returns a tentative per-session sequence number that clients can use
+        as the edit id until the batch is committed.
+        
+        Raises:
+            ValueError: If the session is being ended
+        """
+        if session_id in self.closing_sessions:
+            raise ValueError(f"Session {session_id} is ending")
+        
+        if session_id not in self.delta_queues:
+            self.delta_queues[session_id] = asyncio.Queue()
+            self.delta_seq.setdefault(session_id, count(1))
+        
+        writer = self.delta_writers.get(session_id)
+        if writer is None or writer.done():
+            self.delta_writers[session_id] = asyncio.create_task(self._delta_writer(session_id))
+        
+        self.delta_queues[session_id].put_nowait(PendingDelta(segmentation_id, user_id, delta))
+        return next(self.delta_seq[session_id])
+    
+    async def _delta_writer(self, session_id: int):
+        """Drain the session's delta queue, committing up to DELTA_BATCH_SIZE deltas at a time"""
+        queue = self.delta_queues[session_id]
+        while True:
+            try:
+                pending = [await asyncio.wait_for(queue.get(), self.DELTA_WRITER_IDLE_SECONDS)]
+            except asyncio.TimeoutError:
+                if session_id not in self.active_connections and queue.empty():
+                    del self.delta_queues[session_id]
+                    del self.delta_writers[session_id]
+                    self.delta_seq.pop(session_id, None)
+                    return
+                continue
+            
+            await asyncio.sleep(self.DELTA_COMPOSE_SECONDS)
+            try:
+                while len(pending) < self.DELTA_BATCH_SIZE:
+                    pending.append(queue.get_nowait())
+            except asyncio.QueueEmpty:
+                pass
+            
+            last = pending[-1]
+            try:
+                project_id, snapshot_due = await self._write_batch(session_id, pending)
+            except Exception:
+                # The deltas were already acked, so clients must reload to drop them
+                logger.exception(f"Dropped {len(pending)} deltas for session {session_id}")
+                await self._request_resync(session_id)
+            else:
+                await invalidate_segmentation(last.segmentation_id, project_id)
+                if snapshot_due:
+                    self.schedule_snapshot(session_id, last.segmentation_id, last.user_id)
+            finally:
+                # Only now does flush_session see the batch as done
+                for _ in pending:
+                    queue.task_done()
+    
+    async def _write_batch(self, session_id: int, pending: List[PendingDelta]) -> Tuple[Optional[int], bool]:
+        """Write a batch off the event loop, retrying with backoff; a failed attempt commits nothing"""
+        for attempt in range(1, self.DELTA_WRITE_ATTEMPTS + 1):
+            try:
+                return await asyncio.to_thread(_write_delta_batch, session_id, pending)
+            except ValueError:
+                raise  # the session is over - retrying won't help
+            except Exception as e:
+                if attempt == self.DELTA_WRITE_ATTEMPTS:
+                    raise
+                logger.warning(f"Delta write attempt {attempt} failed for session {session_id}: {e}")
+                await asyncio.sleep(self.DELTA_RETRY_SECONDS * attempt)
+    
+    async def _request_resync(self, session_id: int):
+        """Tell a session's clients their view includes deltas that were not saved"""
+        try:
+            await self.broadcast(
+                session_id,
+                {
+                    "type": "resync",
+                    "session_id": session_id,
+                    "message": "Recent edits could not be saved; reload the segmentation",
+                    "timestamp": datetime.utcnow().isoformat()
+                }
+            )
+        except Exception:
+            logger.exception(f"Resync broadcast failed for session {session_id}")
+    
+    async def flush_session(self, session_id: int):
+        """
+        Refuse new deltas for a session on every worker and wait until each
+        has committed the ones it queued and any snapshot underway has landed
+        
+        Call release_session afterwards, whether or not the session ended.
+        Workers that don't answer within FLUSH_TIMEOUT_SECONDS are given up
+        on; their late deltas are refused once the session has ended.
+        """
+        await self._flush_local_session(session_id)
+        
+        redis = get_redis()
+        if redis is None:
+            return
+        reply_channel = f"sessions:flushed:{uuid.uuid4().hex}"
+        pubsub = redis.pubsub()
+        try:
+            await pubsub.subscribe(reply_channel)
+            # Every worker subscribed to the control channel (this one included) acks once
+            expected = await redis.publish(self.CONTROL_CHANNEL, orjson.dumps({
+                "op": "flush", "session_id": session_id, "reply": reply_channel
+            }))
+            await asyncio.wait_for(self._await_acks(pubsub, expected), self.FLUSH_TIMEOUT_SECONDS)
+        except (RedisError, asyncio.TimeoutError) as e:
+            logger.warning(f"Not every worker confirmed flushing session {session_id}: {e!r}")
+        finally:
+            try:
+                await pubsub.aclose()
+            except RedisError:
+                pass
+    
+    @staticmethod
+    async def _await_acks(pubsub, expected: int):
+        """Wait for a number of replies on a subscribed pub/sub connection"""
+        acked = 0
+        while acked < expected:
+            if await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0) is not None:
+                acked += 1
+    
+    async def _handle_control(self, request: dict):
+        """Act on a session-wide request published on CONTROL_CHANNEL"""
+        session_id = request["session_id"]
+        try:
+            if request["op"] == "flush":
+                await self._flush_local_session(session_id)
+                await get_redis().publish(request["reply"], self.instance_id)
+            elif request["op"] == "release":
+                self._release_local_session(session_id, request["ended"])
+        except Exception:
+            logger.exception(f"Failed to {request['op']} session {session_id}")
+    
+    async def _flush_local_session(self, session_id: int):
+        """Refuse new deltas on this worker and wait for its queued ones and snapshot"""
+        self.closing_sessions.add(session_id)
+        queue = self.delta_queues.get(session_id)
+        if queue is not None:
+            await queue.join()
+        # The thread can't be interrupted, so wait for it rather than cancel
+        snapshot = self.snapshot_tasks.get(session_id)
+        if snapshot is not None:
+            await snapshot
+    
+    async def release_session(self, session_id: int, ended: bool):
+        """Undo flush_session on every worker"""
+        self._release_local_session(session_id, ended)
+        
+        redis = get_redis()
+        if redis is None:
+            return
+        try:
+            await redis.publish(self.CONTROL_CHANNEL, orjson.dumps({
+                "op": "release", "session_id": session_id, "ended": ended
+            }))
+        except RedisError as e:
+            logger.warning(f"Failed to release session {session_id} on other workers: {e}")
+    
+    def _release_local_session(self, session_id: int, ended: bool):
+        """
+        Accept deltas again after a failed end, or forget an ended session
+        once no socket can still send to it (disconnect handles the rest)
+        """
+        if not ended or session_id not in self.active_connections:
+            self.closing_sessions.discard(session_id)
+    
+    def schedule_snapshot(self, session_id: int, segmentation_id: int, user_id: int):
+        """
+        Create a session snapshot in the background, unless one is already underway
+        
+        The session stays due until the snapshot lands, so batches written
+        meanwhile land here and are absorbed by the running snapshot.
+        """
+        task = self.snapshot_tasks.get(session_id)
+        if task is None or task.done():
+            self.snapshot_tasks[session_id] = asyncio.create_task(
+                self._snapshot(session_id, segmentation_id, user_id)
+            )
+    
+    async def _snapshot(self, session_id: int, segmentation_id: int, user_id: int):
+        """Reconstruct and store a snapshot off the event loop"""
+        try:
+            await asyncio.to_thread(_create_snapshot, segmentation_id, session_id, user_id)
+        except Exception:
+            logger.exception(f"Snapshot failed for session {session_id}")
+        finally:
+            self.snapshot_tasks.pop(session_id, None)
+    
+    def get_session_users(self, session_id: int) -> KeysView[int]:
+        """Get all user IDs in a session"""
+        if session_id not in self.session_users:
+            return {}.keys()
+        return self.session_users[session_id].keys()
 
 
 manager = ConnectionManager()
 
 
+async def receive_message(websocket: WebSocket) -> dict:
+    """
+    Receive one JSON message, parsed with orjson
+    Accepts both binary and text frames
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    raw = message.get("bytes")
+    if raw is None:
+        raw = message.get("text")
+    return orjson.loads(raw)
+
+
 async def get_current_user_ws(
     token: str = Query(...),
     db: Session = Depends(get_db)
@@ -92,15 +557,13 @@ async def get_current_user_ws(
     """
     Authenticate WebSocket connection using token query parameter
     """
-    from routers.auth import verify_token
-    
     try:
         payload = verify_token(token)
-        user_id = payload.get("user_id")
-        if not user_id:
+        email = payload.get("sub")
+        if not email:
             raise HTTPException(status_code=401, detail="Invalid token")
         
-        user = db.query(User).filter(User.id == user_id).first()
+        user = db.query(User).filter(User.email == email).first()
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
         
@@ -126,7 +589,9 @@ def start_collaborative_session(
     Returns session_id and WebSocket URL to connect to
     """
     # Get segmentation
-    segmentation = db.query(Segmentation).filter(
+    segmentation = db.query(Segmentation).options(
+        joinedload(Segmentation.project).selectinload(Project.collaborators)
+    ).filter(
         Segmentation.id == request.segmentation_id
     ).first()
     
@@ -152,6 +617,9 @@ def start_collaborative_session(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     
+    # Cached segmentation details carry the active session id
+    anyio.from_thread.run(invalidate_segmentation, segmentation.id, segmentation.project_id)
+    
     return {
         "session_id": session.id,
         "segmentation_id": session.segmentation_id,
@@ -186,7 +654,11 @@ async def websocket_endpoint(
         return
     
     # Verify session exists and is active
-    session = db.query(CollaborativeSession).filter(
+    # Segmentation and project come along; collaborators load only if a check needs them
+    session = db.query(CollaborativeSession).options(
+        joinedload(CollaborativeSession.segmentation)
+        .joinedload(Segmentation.project)
+    ).filter(
         CollaborativeSession.id == session_id
     ).first()
     
@@ -194,9 +666,10 @@ async def websocket_endpoint(
         await websocket.close(code=1008, reason="Session not found or inactive")
         return
     
-    # Check permissions
-    perm_service = PermissionService(db)
+    # Check permissions - once per connection, so a revoked role takes effect on reconnect;
+    # deltas are not re-authorized. Owners need no query, others one collaborator lookup
     segmentation = session.segmentation
+    perm_service = PermissionService(db)
     if not perm_service.can_edit(current_user, segmentation.project):
         await websocket.close(code=1008, reason="Access denied")
         return
@@ -208,62 +681,66 @@ async def websocket_endpoint(
     # Connect to WebSocket
     await manager.connect(websocket, session_id, current_user.id)
     
-    # Notify others that user joined
-    await manager.broadcast(
-        session_id,
-        {
-            "type": "user_joined",
-            "user_id": current_user.id,
-            "username": current_user.username,
-            "timestamp": datetime.utcnow().isoformat()
-        },
-        exclude=websocket
-    )
-    
-    # Send current session state to new user
-    await manager.send_personal(
-        websocket,
-        {
-            "type": "session_state",
-            "session_id": session_id,
-            "segmentation_id": session.segmentation_id,
-            "active_users": list(manager.get_session_users(session_id)),
-            "timestamp": datetime.utcnow().isoformat()
-        }
-    )
-    
-    seg_service = SegmentationService(db)
-    
     try:
+        joined_at = datetime.utcnow().isoformat()
+        
+        # Notify others that user joined
+        await manager.broadcast(
+            session_id,
+            {
+                "type": "user_joined",
+                "user_id": current_user.id,
+                "username": current_user.username,
+                "timestamp": joined_at
+            },
+            exclude=websocket
+        )
+        
+        # Send current session state to new user
+        await manager.send_personal(
+            websocket,
+            {
+                "type": "session_state",
+                "session_id": session_id,
+                "segmentation_id": session.segmentation_id,
+                "active_users": await manager.get_active_users(session_id),
+                "timestamp": joined_at
+            }
+        )
+        
         while True:
             # Receive message from client
-            data = await websocket.receive_json()
+            data = await receive_message(websocket)
             message_type = data.get("type")
+            # One timestamp per inbound message, shared by broadcast and ack
+            now_iso = datetime.utcnow().isoformat()
             
             if message_type == "delta":
                 # Apply segmentation delta
                 delta = data.get("delta")
                 if delta:
                     try:
-                        edit = seg_service.apply_delta(
-                            segmentation_id=session.segmentation_id,
-                            delta=delta,
-                            user_id=current_user.id,
-                            session_id=session_id
+                        # Parsed here so a malformed delta is reported to the sender;
+                        # encoded and persisted asynchronously by the session's delta writer
+                        columns = DeltaManager.create_delta(
+                            delta.get("action"), delta["voxel_changes"], delta.get("metadata")
+                        )
+                        edit_id = manager.enqueue_delta(
+                            session_id, session.segmentation_id, current_user.id, columns
                         )
                         
-                        # Broadcast delta to all other users
-                        await manager.broadcast(
+                        # Broadcast delta to all other users, batched with the rest of the burst
+                        manager.cork_delta(
                             session_id,
+                            websocket,
                             {
                                 "type": "delta",
                                 "user_id": current_user.id,
                                 "username": current_user.username,
                                 "delta": delta,
-                                "edit_id": edit.id,
-                                "timestamp": datetime.utcnow().isoformat()
-                            },
-                            exclude=websocket
+                                "edit_id": edit_id,
+                                "timestamp": now_iso
+                            }
                         )
                         
                         # Acknowledge to sender
@@ -271,8 +748,8 @@ async def websocket_endpoint(
                             websocket,
                             {
                                 "type": "delta_ack",
-                                "edit_id": edit.id,
-                                "timestamp": datetime.utcnow().isoformat()
+                                "edit_id": edit_id,
+                                "timestamp": now_iso
                             }
                         )
                     except Exception as e:
@@ -281,7 +758,7 @@ async def websocket_endpoint(
                             {
                                 "type": "error",
                                 "message": f"Failed to apply delta: {str(e)}",
-                                "timestamp": datetime.utcnow().isoformat()
+                                "timestamp": now_iso
                             }
                         )
             
@@ -294,7 +771,7 @@ async def websocket_endpoint(
                         "user_id": current_user.id,
                         "username": current_user.username,
                         "position": data.get("position"),
-                        "timestamp": datetime.utcnow().isoformat()
+                        "timestamp": now_iso
                     },
                     exclude=websocket
                 )
@@ -308,7 +785,7 @@ async def websocket_endpoint(
                         "user_id": current_user.id,
                         "username": current_user.username,
                         "message": data.get("message"),
-                        "timestamp": datetime.utcnow().isoformat()
+                        "timestamp": now_iso
                     }
                 )
             
@@ -318,7 +795,7 @@ async def websocket_endpoint(
                     websocket,
                     {
                         "type": "pong",
-                        "timestamp": datetime.utcnow().isoformat()
+                        "timestamp": now_iso
                     }
                 )
     
@@ -337,13 +814,16 @@ async def websocket_endpoint(
             }
         )
     
-    except Exception as e:
-        print(f"WebSocket error: {e}")
+    except Exception:
+        logger.exception(f"WebSocket error in session {session_id}")
+    
+    finally:
+        # However the socket ended, it must not stay registered
         manager.disconnect(websocket, session_id)
 
 
 @router.post("/sessions/{session_id}/end")
-def end_collaborative_session(
+async def end_collaborative_session(
     session_id: int,
     create_final_version: bool = True,
     db: Session = Depends(get_db),
@@ -354,29 +834,38 @@ def end_collaborative_session(
     
     - **create_final_version**: Whether to create a final version (default: true)
     """
-    session_service = SessionService(db)
-    
-    try:
-        session = session_service.end_session(
+    def end_session():
+        session = SessionService(db).end_session(
             session_id=session_id,
             user_id=current_user.id,
             create_final_version=create_final_version
         )
+        return session, session.segmentation.project_id
+    
+    # Every acked delta has to be committed before the final version is reconstructed
+    await manager.flush_session(session_id)
+    ended = False
+    try:
+        # Sync SQLAlchemy work runs in a worker thread, off the event loop
+        session, project_id = await anyio.to_thread.run_sync(end_session)
+        ended = True
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await manager.release_session(session_id, ended)
+    
+    await invalidate_segmentation(session.segmentation_id, project_id)
     
     # Notify all connected users that session ended
-    asyncio.create_task(
-        manager.broadcast(
-            session_id,
-            {
-                "type": "session_ended",
-                "session_id": session_id,
-                "ended_by": current_user.id,
-                "final_version_id": session.final_version_id,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-        )
+    await manager.broadcast(
+        session_id,
+        {
+            "type": "session_ended",
+            "session_id": session_id,
+            "ended_by": current_user.id,
+            "final_version_id": session.final_version_id,
+            "timestamp": datetime.utcnow().isoformat()
+        }
     )
     
     return {
@@ -416,7 +905,7 @@ def get_active_sessions(
             },
             "started_at": s.started_at,
             "session_name": s.session_name,
-            "active_users": list(manager.get_session_users(s.id))
+            "active_users": anyio.from_thread.run(manager.get_active_users, s.id)
         }
         for s in sessions
     ]
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import or_, exists
 from typing import List
 from pydantic import BaseModel, Field
 from datetime import datetime
@@ -65,9 +65,12 @@ def create_project(
         owner_id=current_user.id
     )
     db.add(new_project)
+    # INSERT ... RETURNING populates id and server defaults (eager_defaults),
+    # so the response can be built without re-selecting the row after commit
+    db.flush()
+    response = ProjectResponse.model_validate(new_project)
     db.commit()
-    db.refresh(new_project)
-    return new_project
+    return response
 
 
 @router.get("", response_model=List[ProjectListItem])
@@ -76,35 +79,46 @@ def list_my_projects(
     current_user: User = Depends(get_current_user)
 ):
     """List all projects where current user is owner or collaborator"""
-    owned = db.query(Project).filter(Project.owner_id == current_user.id).all()
-    shared = (
+    all_projects = (
         db.query(Project)
-        .join(ProjectCollaborator)
-        .filter(ProjectCollaborator.user_id == current_user.id)
+        .outerjoin(ProjectCollaborator, ProjectCollaborator.project_id == Project.id)
+        .filter(or_(
+            Project.owner_id == current_user.id,
+            ProjectCollaborator.user_id == current_user.id,
+        ))
+        .options(selectinload(Project.collaborators))
+        .distinct()
         .all()
     )
-    all_projects = {p.id: p for p in owned + shared}.values()
+
+    # Fetch every locker's username in one round-trip
+    locker_ids = {p.locked_by_id for p in all_projects if p.is_locked and p.locked_by_id}
+    lockers = {}
+    if locker_ids:
+        lockers = {
+            u.id: u.username
+            for u in db.query(User.id, User.username).filter(User.id.in_(locker_ids))
+        }
 
     result = []
     for project in all_projects:
         role = "owner" if project.owner_id == current_user.id else "unknown"
 
         if role == "unknown":
-            collab = (
-                db.query(ProjectCollaborator)
-                .filter_by(project_id=project.id, user_id=current_user.id)
-                .first()
+            collab = next(
+                (c for c in project.collaborators if c.user_id == current_user.id),
+                None,
             )
             if collab:
                 role = collab.role.value  
 
         locked_by_username = None
         if project.is_locked and project.locked_by_id:
-            locker = db.query(User).get(project.locked_by_id)
-            locked_by_username = locker.username if locker else None
+            locked_by_username = lockers.get(project.locked_by_id)
 
+        # Values come straight from typed ORM columns - skip re-validation
         result.append(
-            ProjectListItem(
+            ProjectListItem.model_construct(
                 id=project.id,
                 name=project.name,
                 description=project.description,
@@ -126,19 +140,21 @@ def get_project_detail(
     current_user: User = Depends(get_current_user)
 ):
     """Get detailed information about a specific project"""
-    project = db.query(Project).filter(Project.id == project_id).first()
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-
-    is_owner = project.owner_id == current_user.id
-    is_collaborator = (
-        db.query(ProjectCollaborator)
-        .filter_by(project_id=project.id, user_id=current_user.id)
+    # Fetch the project and the access check in a single statement
+    is_collaborator = exists().where(
+        ProjectCollaborator.project_id == Project.id,
+        ProjectCollaborator.user_id == current_user.id,
+    )
+    row = (
+        db.query(Project, or_(Project.owner_id == current_user.id, is_collaborator))
+        .filter(Project.id == project_id)
         .first()
-        is not None
     )
+    if not row:
+        raise HTTPException(status_code=404, detail="Project not found")
 
-    if not (is_owner or is_collaborator):
+    project, has_access = row
+    if not has_access:
         raise HTTPException(
             status_code=403,
             detail="You don't have access to this project"
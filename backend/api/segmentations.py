@@ -1,16 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from typing import List, Optional
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Response
+from fastapi.responses import FileResponse
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, joinedload, undefer
+from sqlalchemy.orm.attributes import set_committed_value
+from typing import List, Optional, Tuple
+from pydantic import BaseModel, Field, TypeAdapter
 from datetime import datetime
+import anyio
+import functools
+import orjson
 
 from database import get_db
-from models import User, Project, Segmentation, SegmentationVersion
+from redis_client import (
+    cache_get, cache_set, invalidate_segmentation,
+    segmentation_cache_key, segmentation_list_cache_key
+)
+from models import User, Project, Segmentation, SegmentationVersion, SegmentationEdit, EditType
 from .auth import get_current_user
 from .storage_service import get_storage_service
 from services.segmentation_service import SegmentationService
-from services.permission_service import PermissionService
+from services.permission_service import PermissionService, permission_query_options
 
 router = APIRouter(prefix="/segmentations", tags=["Segmentations"])
 
@@ -57,6 +66,9 @@ class VersionResponse(BaseModel):
         from_attributes = True
 
 
+segmentation_list_adapter = TypeAdapter(List[SegmentationResponse])
+
+
 @router.post("", response_model=SegmentationResponse, status_code=status.HTTP_201_CREATED)
 async def create_segmentation(
     segmentation_in: SegmentationCreate,
@@ -73,7 +85,9 @@ async def create_segmentation(
     - **file**: .nrrd file containing the segmentation data
     """
     # Check if project exists
-    project = db.query(Project).filter(Project.id == segmentation_in.project_id).first()
+    project = db.query(Project).options(*permission_query_options()).filter(
+        Project.id == segmentation_in.project_id
+    ).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
@@ -102,15 +116,19 @@ async def create_segmentation(
     db.add(new_segmentation)
     db.flush()  # Get the ID without committing
     
-    # Save the file using SegmentationService
+    # The upload is already spooled to a temp file; compressing, hashing and
+    # storing it go through save_full_segmentation in a worker thread, off the event loop
     seg_service = SegmentationService(db)
     try:
-        edit, version = seg_service.save_full_segmentation(
-            segmentation_id=new_segmentation.id,
-            file_data=file.file,
-            user_id=current_user.id,
-            change_description="Initial segmentation",
-            create_version=True
+        edit, version = await anyio.to_thread.run_sync(
+            functools.partial(
+                seg_service.save_full_segmentation,
+                segmentation_id=new_segmentation.id,
+                file_data=file.file,
+                user_id=current_user.id,
+                change_description="Initial segmentation",
+                create_version=True
+            )
         )
     except Exception as e:
         db.rollback()
@@ -121,12 +139,11 @@ async def create_segmentation(
     
     db.commit()
     db.refresh(new_segmentation)
+    await invalidate_segmentation(new_segmentation.id, new_segmentation.project_id)
     
-    # Return response with version count
-    return SegmentationResponse(
-        **new_segmentation.__dict__,
-        version_count=1
-    )
+    # A new segmentation has exactly its initial version - set it so validation doesn't query
+    set_committed_value(new_segmentation, "version_count", 1)
+    return SegmentationResponse.model_validate(new_segmentation)
 
 
 @router.get("/{segmentation_id}", response_model=SegmentationDetailResponse)
@@ -138,7 +155,24 @@ def get_segmentation(
     """
     Get detailed information about a segmentation
     """
-    segmentation = db.query(Segmentation).filter(
+    cache_key = segmentation_cache_key(segmentation_id)
+    cached = anyio.from_thread.run(cache_get, cache_key)
+    if cached is not None:
+        # Cached payload is shared by all users, so access is still checked per request
+        project = db.query(Project).options(*permission_query_options()).filter(
+            Project.id == orjson.loads(cached)["project_id"]
+        ).first()
+        if project is not None:
+            if not PermissionService(db).can_view(current_user, project):
+                raise HTTPException(status_code=403, detail="Access denied")
+            return Response(content=cached, media_type="application/json")
+    
+    segmentation = db.query(Segmentation).options(
+        undefer(Segmentation.version_count),
+        joinedload(Segmentation.project).selectinload(Project.collaborators),
+        joinedload(Segmentation.creator),
+        joinedload(Segmentation.last_editor),
+    ).filter(
         Segmentation.id == segmentation_id
     ).first()
     
@@ -150,13 +184,17 @@ def get_segmentation(
     if not perm_service.can_view(current_user, segmentation.project):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Get version count
-    version_count = len(segmentation.versions)
-    
     # Get latest version
     latest_version = None
-    if segmentation.versions:
-        latest = sorted(segmentation.versions, key=lambda v: v.version_number, reverse=True)[0]
+    latest = db.query(SegmentationVersion).with_entities(
+        SegmentationVersion.id,
+        SegmentationVersion.version_number,
+        SegmentationVersion.created_at,
+        SegmentationVersion.change_description
+    ).filter(
+        SegmentationVersion.segmentation_id == segmentation_id
+    ).order_by(SegmentationVersion.version_number.desc()).limit(1).first()
+    if latest:
         latest_version = {
             "id": latest.id,
             "version_number": latest.version_number,
@@ -171,9 +209,17 @@ def get_segmentation(
         CollaborativeSession.status == SessionStatus.ACTIVE
     ).first()
     
-    return SegmentationDetailResponse(
-        **segmentation.__dict__,
-        version_count=version_count,
+    # Construct manually - eager-loaded relationships in __dict__ would clash with creator/last_editor
+    response = SegmentationDetailResponse(
+        id=segmentation.id,
+        project_id=segmentation.project_id,
+        name=segmentation.name,
+        color=segmentation.color,
+        created_by_id=segmentation.created_by_id,
+        created_at=segmentation.created_at,
+        updated_at=segmentation.updated_at,
+        last_editor_id=segmentation.last_editor_id,
+        version_count=segmentation.version_count,
         creator={
             "id": segmentation.creator.id,
             "username": segmentation.creator.username
@@ -186,66 +232,96 @@ def get_segmentation(
         is_locked=segmentation.project.is_locked,
         active_session_id=active_session.id if active_session else None
     )
+    
+    payload = response.model_dump_json().encode()
+    anyio.from_thread.run(cache_set, cache_key, payload)
+    return Response(content=payload, media_type="application/json")
 
 
-@router.get("/{segmentation_id}/download")
-def download_segmentation(
+def _resolve_download(
     segmentation_id: int,
-    version_id: Optional[int] = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
+    version_id: Optional[int],
+    db: Session,
+    current_user: User
+) -> Tuple[str, str]:
     """
-    Download segmentation .nrrd file
+    Check access and find the file to download
     
-    - **version_id**: Optional - download specific version (defaults to latest)
+    Returns:
+        Tuple of (relative file path, download filename)
     """
-    segmentation = db.query(Segmentation).filter(
+    # Latest full save/snapshot path, fetched in the same round-trip as the
+    # segmentation; the edit history is only consulted for rows without the pointer
+    latest_file_path = func.coalesce(
+        Segmentation.latest_full_save_path,
+        select(SegmentationEdit.file_path).where(
+            SegmentationEdit.segmentation_id == Segmentation.id,
+            SegmentationEdit.edit_type.in_([EditType.FULL_SAVE, EditType.SNAPSHOT])
+        ).order_by(SegmentationEdit.created_at.desc(), SegmentationEdit.id.desc()).limit(1).scalar_subquery()
+    )
+    
+    row = db.query(Segmentation, latest_file_path).options(
+        joinedload(Segmentation.project).selectinload(Project.collaborators)
+    ).filter(
         Segmentation.id == segmentation_id
     ).first()
     
-    if not segmentation:
+    if not row:
         raise HTTPException(status_code=404, detail="Segmentation not found")
+    segmentation, latest_path = row
     
     # Check permissions
     perm_service = PermissionService(db)
     if not perm_service.can_view(current_user, segmentation.project):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Get file data
-    seg_service = SegmentationService(db)
+    # Get the file path from version or latest edit
+    if version_id:
+        version = db.query(SegmentationVersion).filter(
+            SegmentationVersion.id == version_id,
+            SegmentationVersion.segmentation_id == segmentation_id
+        ).first()
+        if not version:
+            raise HTTPException(status_code=404, detail="Version not found")
+        return version.file_path, f"{segmentation.name}_v{version.version_number}.nrrd"
+    
+    if not latest_path:
+        raise HTTPException(status_code=404, detail="Segmentation file not found")
+    return latest_path, f"{segmentation.name}_latest.nrrd"
+
+
+@router.get("/{segmentation_id}/download")
+async def download_segmentation(
+    segmentation_id: int,
+    version_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Download segmentation .nrrd file
+    
+    - **version_id**: Optional - download specific version (defaults to latest)
+    """
     storage = get_storage_service()
     
     try:
-        # Get the file path from version or latest edit
-        if version_id:
-            version = db.query(SegmentationVersion).filter(
-                SegmentationVersion.id == version_id,
-                SegmentationVersion.segmentation_id == segmentation_id
-            ).first()
-            if not version:
-                raise HTTPException(status_code=404, detail="Version not found")
-            file_path = version.file_path
-            filename = f"{segmentation.name}_v{version.version_number}.nrrd"
-        else:
-            data = seg_service.get_segmentation_data(segmentation_id)
-            # Get file path from latest edit for streaming
-            from models import SegmentationEdit, EditType
-            latest_edit = db.query(SegmentationEdit).filter(
-                SegmentationEdit.segmentation_id == segmentation_id,
-                SegmentationEdit.edit_type.in_([EditType.FULL_SAVE, EditType.SNAPSHOT])
-            ).order_by(SegmentationEdit.created_at.desc()).first()
-            file_path = latest_edit.file_path
-            filename = f"{segmentation.name}_latest.nrrd"
+        # Sync SQLAlchemy work runs in a worker thread, off the event loop
+        file_path, filename = await anyio.to_thread.run_sync(
+            _resolve_download, segmentation_id, version_id, db, current_user
+        )
         
-        # Stream file for efficient memory usage
-        return StreamingResponse(
-            storage.get_file_stream(file_path),
-            media_type="application/octet-stream",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}"
-            }
+        if not storage.file_exists(file_path):
+            raise FileNotFoundError(file_path)
+        
+        # Local files are served directly - the server can use sendfile instead of copying chunks
+        # through Python
+        return FileResponse(
+            path=str(storage.get_full_path(file_path)),
+            filename=filename,
+            media_type="application/octet-stream"
         )
+    except HTTPException:
+        raise
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Segmentation file not found")
     except Exception as e:
@@ -264,7 +340,9 @@ def get_version_history(
     
     - **limit**: Optional - limit number of versions returned
     """
-    segmentation = db.query(Segmentation).filter(
+    segmentation = db.query(Segmentation).options(
+        joinedload(Segmentation.project).selectinload(Project.collaborators)
+    ).filter(
         Segmentation.id == segmentation_id
     ).first()
     
@@ -283,7 +361,12 @@ def get_version_history(
     # Format response
     return [
         VersionResponse(
-            **v.__dict__,
+            id=v.id,
+            version_number=v.version_number,
+            created_by_id=v.created_by_id,
+            created_at=v.created_at,
+            change_description=v.change_description,
+            is_complete_state=v.is_complete_state,
             creator={
                 "id": v.creator.id,
                 "username": v.creator.username
@@ -301,7 +384,9 @@ def list_project_segmentations(
     """
     List all segmentations in a project
     """
-    project = db.query(Project).filter(Project.id == project_id).first()
+    project = db.query(Project).options(*permission_query_options()).filter(
+        Project.id == project_id
+    ).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
@@ -310,17 +395,23 @@ def list_project_segmentations(
     if not perm_service.can_view(current_user, project):
         raise HTTPException(status_code=403, detail="Access denied")
     
+    cache_key = segmentation_list_cache_key(project_id)
+    cached = anyio.from_thread.run(cache_get, cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    
     # Get segmentations
-    segmentations = db.query(Segmentation).filter(
+    segmentations = db.query(Segmentation).options(
+        undefer(Segmentation.version_count)
+    ).filter(
         Segmentation.project_id == project_id
     ).all()
     
-    return [
-        SegmentationResponse(
-            **seg.__dict__,
-            version_count=len(seg.versions)
-        )
+    payload = segmentation_list_adapter.dump_json([
+        SegmentationResponse.model_validate(seg)
         for seg in segmentations
-    ]
+    ])
+    anyio.from_thread.run(cache_set, cache_key, payload)
+    return Response(content=payload, media_type="application/json")
 
 
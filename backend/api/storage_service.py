@@ -1,10 +1,15 @@
 import os
-import shutil
+import functools
 import logging
+import threading
 from pathlib import Path
-from typing import BinaryIO, Optional, Generator
-from datetime import datetime
-import uuid
+from typing import BinaryIO, Optional, Generator, Iterable, Tuple
+from datetime import datetime, timezone
+import time
+import secrets
+from redis import RedisError
+
+from redis_client import get_sync_redis
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -12,6 +17,16 @@ logger = logging.getLogger(__name__)
 # Configuration - default to local storage in ./storage directory
 STORAGE_BASE_PATH = os.getenv("STORAGE_PATH", "./storage")
 
+# NRRD volumes run to hundreds of MB - large reads keep syscall count low and let readahead work
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Writes are gathered into blocks this size before they reach the file
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Subdirectories counted in storage stats, and the Redis hash holding their running totals
+STATS_SUBDIRS = ['segmentations', 'deltas', 'snapshots', 'versions', 'temp']
+STATS_KEY = "storage:stats"
+
 
 class LocalStorageService:
     """
@@ -21,6 +36,9 @@ class LocalStorageService:
     
     def __init__(self, base_path: str = STORAGE_BASE_PATH):
         self.base_path = Path(base_path).resolve()
+        # In-process running totals, used when Redis isn't configured
+        self._stats: Optional[dict] = None
+        self._stats_lock = threading.Lock()
         self._ensure_directories()
         logger.info(f"LocalStorageService initialized at: {self.base_path}")
     
@@ -43,7 +61,7 @@ class LocalStorageService:
         """
         Generate unique filename with meaningful naming convention
         
-        Format: seg_{id}_v{version}_{type}_{timestamp}_{uuid}.ext
+        Format: seg_{id}_v{version}_{type}_{timestamp}_{random hex}.ext
         Example: seg_123_v5_nrrd_20260111_143025_a1b2c3d4.nrrd
         
         Args:
@@ -54,8 +72,8 @@ class LocalStorageService:
         Returns:
             str: Generated filename
         """
-        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-        unique_id = uuid.uuid4().hex[:8]
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+        unique_id = secrets.token_hex(4)
         
         # Map file types to extensions
         extensions = {
@@ -87,25 +105,36 @@ class LocalStorageService:
         Returns:
             str: Relative file path (stored in database)
         """
-        # Determine subdirectory based on file type
-        subdir_map = {
-            'nrrd': 'segmentations',
-            'delta': 'deltas',
-            'snapshot': 'snapshots',
-            'version': 'versions'
-        }
-        subdir = subdir_map.get(file_type, 'temp')
+        chunks = iter(functools.partial(file_data.read, STREAM_CHUNK_SIZE), b"")
+        return self.save_file_stream(chunks, file_type, segmentation_id, version, metadata)
+    
+    def save_file_stream(self, chunks: Iterable[bytes], file_type: str,
+                         segmentation_id: int, version: Optional[int] = None,
+                         metadata: dict = None) -> str:
+        """
+        Save file data given as a sequence of chunks to local filesystem
         
-        # Generate unique filename
-        filename = self._generate_filename(file_type, segmentation_id, version)
-        full_path = self.base_path / subdir / filename
+        Args:
+            chunks: File data, in order
+            file_type: Type of file ('nrrd', 'delta', 'snapshot', 'version')
+            segmentation_id: ID of segmentation
+            version: Optional version number for versioned files
+            metadata: Optional metadata (currently for logging only)
+            
+        Returns:
+            str: Relative file path (stored in database)
+        """
+        subdir, filename, full_path = self._new_file_path(file_type, segmentation_id, version)
         
         # Save file with error handling
         try:
-            with open(full_path, 'wb') as f:
-                shutil.copyfileobj(file_data, f)
+            file_size = 0
+            with open(full_path, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    file_size += len(chunk)
             
-            file_size = full_path.stat().st_size
+            self._record_stats(subdir, file_size, 1)
             logger.info(f"Saved file: {filename} ({file_size} bytes)")
             
             if metadata:
@@ -118,6 +147,27 @@ class LocalStorageService:
         # Return relative path for database storage
         return f"{subdir}/{filename}"
     
+    def _new_file_path(self, file_type: str, segmentation_id: int,
+                       version: Optional[int] = None) -> Tuple[str, str, Path]:
+        """
+        Pick the subdirectory and a fresh filename for a new file
+        
+        Returns:
+            Tuple of (subdirectory, filename, absolute path)
+        """
+        # Determine subdirectory based on file type
+        subdir_map = {
+            'nrrd': 'segmentations',
+            'delta': 'deltas',
+            'snapshot': 'snapshots',
+            'version': 'versions'
+        }
+        subdir = subdir_map.get(file_type, 'temp')
+        
+        # Generate unique filename
+        filename = self._generate_filename(file_type, segmentation_id, version)
+        return subdir, filename, self.base_path / subdir / filename
+    
     def get_file(self, file_path: str) -> bytes:
         """
         Read entire file from local filesystem
@@ -146,13 +196,34 @@ class LocalStorageService:
             logger.error(f"Failed to read file {file_path}: {e}")
             raise
     
-    def get_file_stream(self, file_path: str, chunk_size: int = 8192) -> Generator[bytes, None, None]:
+    def open_file(self, file_path: str) -> BinaryIO:
+        """
+        Open file for buffered reading, for readers that pull data themselves
+        
+        Args:
+            file_path: Relative path to file
+            
+        Returns:
+            BinaryIO: Open file handle; the caller closes it
+            
+        Raises:
+            FileNotFoundError: If file doesn't exist
+        """
+        full_path = self.base_path / file_path
+        
+        if not full_path.exists():
+            logger.error(f"File not found: {file_path}")
+            raise FileNotFoundError(f"File not found: {file_path}")
+        
+        return open(full_path, 'rb', buffering=STREAM_CHUNK_SIZE)
+    
+    def get_file_stream(self, file_path: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Generator[bytes, None, None]:
         """
         Stream file in chunks for efficient memory usage with large files
         
         Args:
             file_path: Relative path to file
-            chunk_size: Size of each chunk in bytes (default 8KB)
+            chunk_size: Size of each chunk in bytes (default 1MB)
             
         Yields:
             bytes: File chunks
@@ -163,7 +234,11 @@ class LocalStorageService:
             raise FileNotFoundError(f"File not found: {file_path}")
         
         try:
-            with open(full_path, 'rb') as f:
+            fd = os.open(full_path, os.O_RDONLY)
+            # Hint sequential access so the kernel reads ahead aggressively
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            with os.fdopen(fd, 'rb', buffering=0) as f:
                 while chunk := f.read(chunk_size):
                     yield chunk
         except Exception as e:
@@ -184,7 +259,9 @@ class LocalStorageService:
         
         try:
             if full_path.exists():
+                file_size = full_path.stat().st_size
                 full_path.unlink()
+                self._record_stats(file_path.split('/', 1)[0], -file_size, -1)
                 logger.info(f"Deleted file: {file_path}")
                 return True
             else:
@@ -239,39 +316,124 @@ class LocalStorageService:
         
         return full_path.stat().st_size
     
-    def get_storage_stats(self) -> dict:
+    def _record_stats(self, subdir: str, size_delta: int, count_delta: int):
         """
-        Get storage statistics for monitoring disk usage
+        Apply a file save/delete to the running storage totals
         
-        Returns:
-            dict: Storage statistics including total size and file counts
+        Args:
+            subdir: Storage subdirectory the file lives in
+            size_delta: Change in bytes
+            count_delta: Change in file count
         """
-        stats = {
-            'total_size': 0,
-            'file_count': 0,
-            'by_type': {}
-        }
+        if subdir not in STATS_SUBDIRS:
+            return
         
-        for subdir in ['segmentations', 'deltas', 'snapshots', 'versions', 'temp']:
-            dir_path = self.base_path / subdir
-            if not dir_path.exists():
-                continue
-            
+        client = get_sync_redis()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                pipe.hincrby(STATS_KEY, f"{subdir}:size", size_delta)
+                pipe.hincrby(STATS_KEY, f"{subdir}:count", count_delta)
+                pipe.execute()
+            except RedisError as e:
+                logger.warning(f"Failed to update storage stats: {e}")
+            return
+        
+        with self._stats_lock:
+            # Totals not built yet - the first get_storage_stats call will count this file
+            if self._stats is not None:
+                self._stats[subdir]['size'] += size_delta
+                self._stats[subdir]['count'] += count_delta
+    
+    def rebuild_stats(self) -> dict:
+        """
+        Recount storage usage by walking the storage directories
+        
+        O(number of files) - get_storage_stats only calls this when no running
+        totals exist yet. Also useful to correct drift after manual changes.
+        
+        Returns:
+            dict: Per-subdirectory size and file counts
+        """
+        by_type = {}
+        for subdir in STATS_SUBDIRS:
             dir_size = 0
             file_count = 0
             
-            for file_path in dir_path.rglob('*'):
-                if file_path.is_file():
-                    size = file_path.stat().st_size
-                    dir_size += size
-                    file_count += 1
+            dir_path = self.base_path / subdir
+            if dir_path.exists():
+                for file_path in dir_path.rglob('*'):
+                    if file_path.is_file():
+                        dir_size += file_path.stat().st_size
+                        file_count += 1
             
-            stats['by_type'][subdir] = {
+            by_type[subdir] = {
                 'size': dir_size,
                 'count': file_count
             }
-            stats['total_size'] += dir_size
-            stats['file_count'] += file_count
+        
+        client = get_sync_redis()
+        if client is not None:
+            mapping = {"ready": 1}
+            for subdir, entry in by_type.items():
+                mapping[f"{subdir}:size"] = entry['size']
+                mapping[f"{subdir}:count"] = entry['count']
+            try:
+                with client.pipeline() as pipe:
+                    pipe.delete(STATS_KEY)
+                    pipe.hset(STATS_KEY, mapping=mapping)
+                    pipe.execute()
+            except RedisError as e:
+                logger.warning(f"Failed to store storage stats: {e}")
+        else:
+            with self._stats_lock:
+                self._stats = by_type
+        
+        return by_type
+    
+    def _load_stats(self) -> Optional[dict]:
+        """Read the running totals, or None if they haven't been built yet"""
+        client = get_sync_redis()
+        if client is None:
+            with self._stats_lock:
+                if self._stats is None:
+                    return None
+                return {subdir: dict(entry) for subdir, entry in self._stats.items()}
+        
+        try:
+            raw = client.hgetall(STATS_KEY)
+        except RedisError as e:
+            logger.warning(f"Failed to read storage stats: {e}")
+            return None
+        if b"ready" not in raw:
+            return None
+        return {
+            subdir: {
+                'size': int(raw.get(f"{subdir}:size".encode(), 0)),
+                'count': int(raw.get(f"{subdir}:count".encode(), 0))
+            }
+            for subdir in STATS_SUBDIRS
+        }
+    
+    def get_storage_stats(self) -> dict:
+        """
+        Get storage statistics for monitoring disk usage
+        
+        Served from running totals kept up to date by save_file/delete_file,
+        shared across workers through Redis when it is configured.
+        
+        Returns:
+            dict: Storage statistics including total size and file counts
+        """
+        by_type = self._load_stats()
+        if by_type is None:
+            by_type = self.rebuild_stats()
+        
+        stats = {
+            'total_size': sum(entry['size'] for entry in by_type.values()),
+            'file_count': sum(entry['count'] for entry in by_type.values()),
+            'by_type': by_type
+        }
         
         logger.info(f"Storage stats: {stats['file_count']} files, "
                    f"{stats['total_size'] / (1024**3):.2f} GB")
@@ -293,27 +455,33 @@ class LocalStorageService:
             return 0
         
         deleted_count = 0
-        cutoff_time = datetime.utcnow().timestamp() - (max_age_hours * 3600)
+        deleted_size = 0
+        cutoff_time = time.time() - (max_age_hours * 3600)
         
-        for file_path in temp_dir.iterdir():
-            if file_path.is_file():
-                if file_path.stat().st_mtime < cutoff_time:
+        # scandir yields file type with each entry, so only old candidates need a stat
+        with os.scandir(temp_dir) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                file_stat = entry.stat(follow_symlinks=False)
+                if file_stat.st_mtime < cutoff_time:
                     try:
-                        file_path.unlink()
+                        os.unlink(entry.path)
                         deleted_count += 1
-                        logger.debug(f"Cleaned up temp file: {file_path.name}")
+                        deleted_size += file_stat.st_size
+                        logger.debug(f"Cleaned up temp file: {entry.name}")
                     except Exception as e:
-                        logger.error(f"Failed to delete temp file {file_path}: {e}")
+                        logger.error(f"Failed to delete temp file {entry.path}: {e}")
         
         if deleted_count > 0:
+            self._record_stats('temp', -deleted_size, -deleted_count)
             logger.info(f"Cleaned up {deleted_count} temporary files")
         
         return deleted_count
 
 
 # Singleton instance for easy importing
-_storage_instance = None
-
+@functools.lru_cache(maxsize=1)
 def get_storage_service() -> LocalStorageService:
     """
     Get the singleton storage service instance
@@ -321,10 +489,7 @@ def get_storage_service() -> LocalStorageService:
     Returns:
         LocalStorageService: The storage service instance
     """
-    global _storage_instance
-    if _storage_instance is None:
-        _storage_instance = LocalStorageService()
-    return _storage_instance
+    return LocalStorageService()
 
 
 # Usage examples
@@ -1,4 +1,6 @@
 from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
 import os
@@ -9,10 +11,33 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL not set in .env")
 
-engine = create_engine(DATABASE_URL, echo=False, future=True)
+_url = make_url(DATABASE_URL)
+
+# Compiled SQL is cached per statement shape; sized to hold every query the services issue
+QUERY_CACHE_SIZE = 1200
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+ENGINE_OPTIONS = dict(
+    echo=False,
+    query_cache_size=QUERY_CACHE_SIZE,
+    pool_pre_ping=True  # drop connections the server closed while idle
+)
+# SQLite picks its own pool class, which takes no sizing
+if _url.get_backend_name() != "sqlite":
+    ENGINE_OPTIONS.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+
+engine = create_engine(DATABASE_URL, future=True, **ENGINE_OPTIONS)
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False, future=True)
 Base = declarative_base()
 
+# Async engine for endpoints that shouldn't pin a threadpool worker on DB I/O
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+async_engine = create_async_engine(
+    _url.set(drivername=ASYNC_DRIVERS.get(_url.get_backend_name(), _url.drivername)),
+    **ENGINE_OPTIONS
+)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 # Test connection on startup
 try:
     with engine.connect() as conn:
@@ -27,3 +52,6 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
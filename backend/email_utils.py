@@ -1,5 +1,7 @@
 import smtplib
+import threading
 from email.mime.text import MIMEText
+from typing import Optional
 import os
 
 SMTP_SERVER = os.getenv("MAIL_SERVER")
@@ -8,6 +10,22 @@ EMAIL_USER = os.getenv("MAIL_USER")
 EMAIL_PASS = os.getenv("MAIL_PASS")
 FRONTEND_URL = os.getenv("FRONTEND_URL")
 
+# One connection shared by all sends, opened on first use. Sends run in
+# threadpool workers, so the lock keeps SMTP transactions from interleaving.
+_smtp: Optional[smtplib.SMTP] = None
+_smtp_lock = threading.Lock()
+
+def _send(from_addr, to_addr, message):
+    global _smtp
+    if _smtp is None:
+        _smtp = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+    try:
+        _smtp.sendmail(from_addr, to_addr, message)
+    except (smtplib.SMTPServerDisconnected, ConnectionError):
+        # Server dropped the idle connection - reconnect once and retry
+        _smtp = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+        _smtp.sendmail(from_addr, to_addr, message)
+
 def send_verification_email(email, token):
     link = f"{FRONTEND_URL}/verify?token={token}"
 
@@ -17,5 +35,5 @@ def send_verification_email(email, token):
     msg["To"] = email
     print(msg)
 
-    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-        server.sendmail(EMAIL_USER, email, msg.as_string())
+    with _smtp_lock:
+        _send(EMAIL_USER, email, msg.as_string())
@@ -1,19 +1,25 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+import os
 from database import Base, engine
 from api.auth import router as auth_router
 from api.projects import router as projects_router
 from api.collaboration import router as collab_router
 from api.segmentations import router as segmentations_router
 
-app = FastAPI(title="User Authentication API")
+app = FastAPI(title="User Authentication API", default_response_class=ORJSONResponse)
+
+# Comma-separated list, e.g. "https://app.example.com,http://localhost:3000"
+CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PUT", "DELETE", "PATCH"],
+    allow_headers=["Authorization", "Content-Type"],
+    max_age=86400,  # let browsers cache preflights for a day
 )
 
 Base.metadata.create_all(bind=engine)
@@ -1,6 +1,7 @@
 from enum import Enum as PyEnum
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Enum, UniqueConstraint, Index, Text, LargeBinary
-from sqlalchemy.orm import relationship
+import orjson
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Enum, UniqueConstraint, Index, Table, Text, LargeBinary, select, text
+from sqlalchemy.orm import relationship, column_property
 from sqlalchemy.sql import func
 from database import Base
 
@@ -20,7 +21,7 @@ class User(Base):
     email = Column(String(100), unique=True, nullable=False, index=True)
     password = Column(String(255), nullable=False)
     is_verified = Column(Boolean, default=False)
-    email_token = Column(String, nullable=True)
+    email_token = Column(String, nullable=True, index=True)
     
     owned_projects = relationship("Project", back_populates="owner", foreign_keys="[Project.owner_id]")
     collaborations = relationship(
@@ -33,7 +34,7 @@ class User(Base):
 class Project(Base):
     __tablename__ = "projects"
     
-    id          = Column(Integer, primary_key=True, index=True)
+    id          = Column(Integer, primary_key=True)
     name        = Column(String(100), nullable=False)
     description = Column(String, nullable=True)
     created_at  = Column(DateTime, server_default=func.now())
@@ -49,6 +50,8 @@ class Project(Base):
     
     collaborators = relationship("ProjectCollaborator", back_populates="project", cascade="all, delete-orphan")
     segmentations = relationship("Segmentation", back_populates="project", cascade="all, delete-orphan")
+    
+    __mapper_args__ = {"eager_defaults": True}
 
 
 class ProjectCollaborator(Base):
@@ -61,24 +64,43 @@ class ProjectCollaborator(Base):
     
     user        = relationship("User", back_populates="collaborations")
     project     = relationship("Project", back_populates="collaborators")
+    
+    __table_args__ = (
+        # project_id-leading for permission checks and collaborator loading;
+        # the (user_id, project_id) primary key serves per-user project listing
+        Index('ix_collab_project_user', 'project_id', 'user_id', unique=True),
+    )
 
 
 class Segmentation(Base):
     __tablename__ = "segmentations"
     
     id              = Column(Integer, primary_key=True)
-    project_id      = Column(Integer, ForeignKey("projects.id"), nullable=False, index=True)
+    project_id      = Column(Integer, ForeignKey("projects.id"), nullable=False)
     name            = Column(String(120), nullable=False)
     color           = Column(String(9))  # #RRGGBBAA
     created_by_id   = Column(Integer, ForeignKey("users.id"))
     created_at      = Column(DateTime, server_default=func.now())
     updated_at      = Column(DateTime, onupdate=func.now(), nullable=True)
     last_editor_id  = Column(Integer, ForeignKey("users.id"), nullable=True)
+    # Latest full save/snapshot, kept in step with segmentation_edits so the
+    # current file is found without scanning the edit history
+    latest_full_save_edit_id = Column(
+        Integer,
+        ForeignKey("segmentation_edits.id", use_alter=True, name="fk_segmentations_latest_full_save", ondelete="SET NULL"),
+        nullable=True
+    )
+    latest_full_save_path = Column(String(500), nullable=True)
     
     project         = relationship("Project", back_populates="segmentations")
     creator         = relationship("User", foreign_keys=[created_by_id])
     last_editor     = relationship("User", foreign_keys=[last_editor_id])
     versions        = relationship("SegmentationVersion", back_populates="segmentation", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Per-project listing; also serves plain project_id lookups
+        Index('ix_segmentations_project_updated', 'project_id', 'updated_at'),
+    )
 
 
 class SegmentationVersion(Base):
@@ -103,6 +125,16 @@ class SegmentationVersion(Base):
     )
 
 
+# Counted in SQL so callers don't load every version row; deferred - undefer() where needed
+Segmentation.version_count = column_property(
+    select(func.count(SegmentationVersion.id))
+    .where(SegmentationVersion.segmentation_id == Segmentation.id)
+    .correlate_except(SegmentationVersion)
+    .scalar_subquery(),
+    deferred=True
+)
+
+
 class EditType(str, PyEnum):
     FULL_SAVE = "full_save"      # Complete segmentation save (REST)
     DELTA = "delta"               # Incremental change (WebSocket)
@@ -116,29 +148,44 @@ class SegmentationEdit(Base):
     """
     __tablename__ = "segmentation_edits"
     
-    id = Column(Integer, primary_key=True, index=True)
-    segmentation_id = Column(Integer, ForeignKey("segmentations.id"), nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    segmentation_id = Column(Integer, ForeignKey("segmentations.id"), nullable=False)
     edit_type = Column(Enum(EditType), nullable=False, default=EditType.FULL_SAVE)
     
     file_path = Column(String(500), nullable=True)
     
-    delta_data = Column(Text, nullable=True)  
+    delta_data = Column(LargeBinary, nullable=True)  
+    data_size_bytes = Column(Integer, nullable=True)
+    # Content hash of the stored file, so identical saves can share it
+    file_hash = Column(String(64), nullable=True)
+    voxels_modified = Column(Integer, nullable=True)
     
     created_by_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    created_at = Column(DateTime, server_default=func.now(), index=True)
+    created_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
     
-    session_id = Column(Integer, ForeignKey("collaborative_sessions.id"), nullable=True, index=True)
+    session_id = Column(Integer, ForeignKey("collaborative_sessions.id"), nullable=True)
     
     change_description = Column(String(500), nullable=True)
     client_timestamp = Column(DateTime, nullable=True)  
     
-    segmentation = relationship("Segmentation", backref="edits")
+    segmentation = relationship("Segmentation", backref="edits", foreign_keys=[segmentation_id])
     creator = relationship("User")
     session = relationship("CollaborativeSession", back_populates="edits")
     
     __table_args__ = (
         Index('ix_segmentation_edits_lookup', 'segmentation_id', 'created_at'),
-        Index('ix_session_edits', 'session_id', 'created_at'),
+        Index('ix_segmentation_edits_type_lookup', 'segmentation_id', 'edit_type', created_at.desc()),
+        Index('ix_segmentation_edits_hash', 'segmentation_id', 'file_hash'),
+        # Append-only, so rows are physically in time order - BRIN is tiny next to a btree
+        Index('ix_edits_created_brin', 'created_at', postgresql_using='brin'),
+        # Session replay: edit type and location come from the index, so
+        # filtering by type needs no heap fetch (delta_data is too large to include)
+        Index(
+            'ix_session_replay', 'session_id', 'created_at',
+            postgresql_include=['segmentation_id', 'edit_type', 'file_path']
+        ),
+        # Snapshot bookkeeping: latest snapshot and deltas after it, index-only
+        Index('ix_session_edits_by_type', 'session_id', 'segmentation_id', 'edit_type', created_at.desc()),
     )
 
 
@@ -148,6 +195,16 @@ class SessionStatus(str, PyEnum):
     ABANDONED = "abandoned"  
 
 
+# Who is in each session; participants_json is still written alongside it
+session_participants = Table(
+    "session_participants", Base.metadata,
+    Column("session_id", Integer, ForeignKey("collaborative_sessions.id", ondelete="CASCADE"), primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    # The primary key serves per-session lookups; this one serves per-user
+    Index("ix_session_participants_user", "user_id"),
+)
+
+
 class CollaborativeSession(Base):
     """
     Represents a live collaborative editing session.
@@ -155,8 +212,8 @@ class CollaborativeSession(Base):
     """
     __tablename__ = "collaborative_sessions"
     
-    id = Column(Integer, primary_key=True, index=True)
-    segmentation_id = Column(Integer, ForeignKey("segmentations.id"), nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    segmentation_id = Column(Integer, ForeignKey("segmentations.id"), nullable=False)
     
     started_by_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     started_at = Column(DateTime, server_default=func.now())
@@ -177,4 +234,26 @@ class CollaborativeSession(Base):
     __table_args__ = (
         Index('ix_active_sessions', 'segmentation_id', 'status'),
     )
+    
+    # (participants_json it was parsed from, parsed ids)
+    _participants_cache = None
+    
+    @property
+    def participants(self) -> list:
+        """
+        Participant user ids, parsed once per participants_json value
+        
+        Treat the list as read-only; assign a new list to change it.
+        """
+        raw = self.participants_json
+        cached = self._participants_cache
+        if cached is None or cached[0] != raw:
+            cached = self._participants_cache = (raw, orjson.loads(raw or "[]"))
+        return cached[1]
+    
+    @participants.setter
+    def participants(self, user_ids: list):
+        raw = orjson.dumps(user_ids).decode()
+        self.participants_json = raw
+        self._participants_cache = (raw, user_ids)
 
@@ -0,0 +1,84 @@
+from typing import Optional
+from dotenv import load_dotenv
+import redis.asyncio as redis
+from redis import Redis as SyncRedis
+import os
+import logging
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Optional - without it, features that rely on Redis fall back to in-process behaviour
+REDIS_URL = os.getenv("REDIS_URL")
+
+_redis: Optional[redis.Redis] = None
+_sync_redis: Optional[SyncRedis] = None
+
+def get_redis() -> Optional[redis.Redis]:
+    """
+    Get the shared async Redis client, or None if REDIS_URL is not set
+    """
+    global _redis
+    if REDIS_URL and _redis is None:
+        _redis = redis.from_url(REDIS_URL)
+    return _redis
+
+def get_sync_redis() -> Optional[SyncRedis]:
+    """
+    Get the shared blocking Redis client for sync code, or None if REDIS_URL is not set
+    """
+    global _sync_redis
+    if REDIS_URL and _sync_redis is None:
+        _sync_redis = SyncRedis.from_url(REDIS_URL)
+    return _sync_redis
+
+
+# Read-through cache for segmentation metadata responses
+SEGMENTATION_CACHE_TTL = 60
+
+def segmentation_cache_key(segmentation_id: int) -> str:
+    return f"seg:{segmentation_id}"
+
+def segmentation_list_cache_key(project_id: int) -> str:
+    return f"proj:{project_id}:seglist"
+
+async def cache_get(key: str) -> Optional[bytes]:
+    """
+    Get a cached value, or None on miss or when Redis is unavailable
+    """
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        return await client.get(key)
+    except redis.RedisError as e:
+        logger.warning(f"Redis cache read failed for {key}: {e}")
+        return None
+
+async def cache_set(key: str, value: bytes, ttl: int = SEGMENTATION_CACHE_TTL):
+    """
+    Cache a value with a TTL, ignoring Redis failures
+    """
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        await client.set(key, value, ex=ttl)
+    except redis.RedisError as e:
+        logger.warning(f"Redis cache write failed for {key}: {e}")
+
+async def invalidate_segmentation(segmentation_id: int, project_id: int):
+    """
+    Drop cached responses for a segmentation and its project's segmentation list
+    """
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        await client.delete(
+            segmentation_cache_key(segmentation_id),
+            segmentation_list_cache_key(project_id)
+        )
+    except redis.RedisError as e:
+        logger.warning(f"Redis cache invalidation failed for segmentation {segmentation_id}: {e}")
@@ -1,7 +1,134 @@
+import os
+import re
 import json
 import gzip
-from typing import Dict, List, Any, Optional
-from io import BytesIO
+import time
+import base64
+import struct
+import logging
+import threading
+import zlib
+from operator import itemgetter
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
+from io import BytesIO, RawIOBase
+
+import numpy as np
+import orjson
+import zstandard
+from redis import RedisError
+
+from redis_client import get_sync_redis
+
+logger = logging.getLogger(__name__)
+
+# Voxel columns in on-disk order. "old" is not stored - it is whatever the base
+# volume holds at that voxel - but deltas written before that may still carry it.
+VOXEL_FIELDS = ("x", "y", "z", "new")
+COORD_FIELDS = ("x", "y", "z")
+VOXEL_DTYPE = np.dtype("<i4")
+# Label values are stored in the narrowest of these that fits (almost always uint8)
+LABEL_DTYPES = (np.dtype("u1"), np.dtype("<i2"), VOXEL_DTYPE)
+
+# Optional zstd dictionary trained on real deltas (see DeltaManager.train_dictionary).
+# Primes the compressor for small payloads; deltas compressed with a dictionary
+# can only be decoded while that same dictionary is configured.
+# Level 1: on packed deltas it compresses as well as 3, in about 80% of the time.
+ZSTD_LEVEL = 1
+ZSTD_DICT_PATH = os.getenv("DELTA_ZSTD_DICT")
+_zstd_dict = None
+if ZSTD_DICT_PATH:
+    with open(ZSTD_DICT_PATH, 'rb') as f:
+        _zstd_dict = zstandard.ZstdCompressionDict(f.read())
+    # Build the dictionary's compression tables once, not in every thread's compressor
+    _zstd_dict.precompute_compress(level=ZSTD_LEVEL)
+
+# Leading bytes of stored binary deltas. Compressed deltas are bare zstd frames;
+# anything else in delta_data is a text delta from before the column was binary.
+SOA_MAGIC = b"SOA1"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# zstd contexts must not be shared between threads - keep one pair per thread
+_zstd_local = threading.local()
+
+def _zstd_compressor() -> zstandard.ZstdCompressor:
+    compressor = getattr(_zstd_local, "compressor", None)
+    if compressor is None:
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=_zstd_dict)
+        _zstd_local.compressor = compressor
+    return compressor
+
+def _zstd_decompressor() -> zstandard.ZstdDecompressor:
+    decompressor = getattr(_zstd_local, "decompressor", None)
+    if decompressor is None:
+        decompressor = zstandard.ZstdDecompressor(dict_data=_zstd_dict)
+        _zstd_local.decompressor = decompressor
+    return decompressor
+
+def _varint_encode(values: np.ndarray) -> np.ndarray:
+    """
+    LEB128-encode non-negative integers: 7 bits per byte, high bit set on all
+    but each value's last byte. Vectorized; single-byte values take a fast path.
+    """
+    values = values.astype(np.uint64)
+    lengths = np.ones(values.size, dtype=np.int64)
+    largest = int(values.max()) if values.size else 0
+    for shift in range(7, largest.bit_length(), 7):
+        lengths += values >= (np.uint64(1) << np.uint64(shift))
+    
+    ends = np.cumsum(lengths)
+    encoded = np.empty(int(ends[-1]) if values.size else 0, dtype=np.uint8)
+    single = lengths == 1
+    encoded[ends[single] - 1] = values[single]
+    
+    multi = np.flatnonzero(~single)
+    if multi.size:
+        multi_lengths = lengths[multi]
+        owner = np.repeat(multi, multi_lengths)
+        position = np.arange(owner.size) - np.repeat(np.cumsum(multi_lengths) - multi_lengths, multi_lengths)
+        chunks = ((values[owner] >> (np.uint64(7) * position.astype(np.uint64))) & np.uint64(0x7f)).astype(np.uint8)
+        chunks[position < lengths[owner] - 1] |= 0x80
+        encoded[ends[owner] - lengths[owner] + position] = chunks
+    return encoded
+
+
+def _varint_decode(encoded: np.ndarray) -> np.ndarray:
+    """
+    Decode a buffer of LEB128 varints (see _varint_encode) to uint64
+    """
+    ends = np.flatnonzero(encoded < 0x80)
+    lengths = np.diff(ends, prepend=-1)
+    decoded = encoded[ends].astype(np.uint64)
+    
+    multi = np.flatnonzero(lengths > 1)
+    if multi.size:
+        multi_lengths = lengths[multi]
+        group_starts = np.cumsum(multi_lengths) - multi_lengths
+        position = np.arange(int(multi_lengths.sum())) - np.repeat(group_starts, multi_lengths)
+        index = np.repeat(ends[multi] - multi_lengths + 1, multi_lengths) + position
+        chunks = (encoded[index] & 0x7f).astype(np.uint64) << (np.uint64(7) * position.astype(np.uint64))
+        decoded[multi] = np.add.reduceat(chunks, group_starts)
+    return decoded
+
+
+# Header fields that move the data away from right after the header
+_NRRD_LAYOUT_FIELDS = ("datafile", "data file", "lineskip", "line skip", "byteskip", "byte skip")
+_NRRD_RAW_ENCODING = re.compile(rb"^encoding:[ \t]*raw[ \t]*$", re.MULTILINE | re.IGNORECASE)
+
+
+class _ChunkSink(RawIOBase):
+    """Write-only file that keeps each write as a separate chunk"""
+    
+    def __init__(self):
+        super().__init__()
+        self.chunks: List[bytes] = []
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
 
 class DeltaManager:
     """
@@ -11,93 +138,340 @@ class DeltaManager:
     
     # Thresholds for storage decisions
     INLINE_DELTA_MAX_SIZE = 100 * 1024  # 100KB - store in DB directly
+    COMPRESS_MIN_SIZE = 512              # zstd is cheap enough to pay off for small deltas
     SNAPSHOT_INTERVAL_DELTAS = 50        # Create snapshot every 50 deltas
     SNAPSHOT_INTERVAL_MINUTES = 10       # Or every 10 minutes
+    SNAPSHOT_INTERVAL_SECONDS = SNAPSHOT_INTERVAL_MINUTES * 60
+    SNAPSHOT_COMPRESSION_LEVEL = 1       # gzip level for reconstructed volumes
     
     @staticmethod
-    def create_delta(action: str, voxel_changes: List[Dict], metadata: Dict = None) -> Dict:
+    def to_voxel_columns(voxel_changes: Union[List[Dict], Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        """
+        Convert voxel changes to one int32 array per field (structure of arrays)
+        
+        Only VOXEL_FIELDS are kept; "old" values sent by clients are dropped.
+        
+        Args:
+            voxel_changes: Either the wire format list of per-voxel dicts
+                ({"x": 120, "y": 45, "z": 78, "old": 0, "new": 1}) or a dict
+                of per-field sequences
+            
+        Returns:
+            Dict: Field name -> 1-D int32 array
+        """
+        if isinstance(voxel_changes, dict):
+            return {
+                name: np.asarray(voxel_changes[name], dtype=VOXEL_DTYPE)
+                for name in VOXEL_FIELDS
+            }
+        
+        # One C-level itemgetter pass per field - no per-voxel bytecode or rows
+        count = len(voxel_changes)
+        return {
+            name: np.fromiter(map(itemgetter(name), voxel_changes), dtype=VOXEL_DTYPE, count=count)
+            for name in VOXEL_FIELDS
+        }
+    
+    @staticmethod
+    def create_delta(action: str, voxel_changes: Union[List[Dict], Dict[str, Any]],
+                     metadata: Dict = None) -> Dict:
         """
         Create a delta object representing changes
         
         Args:
             action: Type of edit ('paint', 'erase', 'smooth', 'fill', etc.)
-            voxel_changes: List of changed voxels
+            voxel_changes: Changed voxels, as a list of per-voxel dicts
                 Example: [
                     {"x": 120, "y": 45, "z": 78, "old": 0, "new": 1},
                     {"x": 121, "y": 45, "z": 78, "old": 0, "new": 1}
                 ]
+                or as per-field arrays ({"x": [...], "y": [...], ...})
             metadata: Optional metadata (brush size, tool settings, etc.)
             
         Returns:
-            Dict: Delta object
+            Dict: Delta object with voxels stored as int32 columns
         """
+        voxels = DeltaManager.to_voxel_columns(voxel_changes)
         delta = {
             "action": action,
-            "voxel_changes": voxel_changes,
-            "voxel_count": len(voxel_changes),
+            "voxels": voxels,
+            "voxel_count": len(voxels["x"]),
             "metadata": metadata or {}
         }
         return delta
     
     @staticmethod
-    def encode_delta(delta: Dict, compress: bool = True) -> tuple[str, int]:
+    def compose_deltas(deltas: List[Dict]) -> Dict:
         """
-        Encode delta to JSON string, optionally compressed
+        Merge consecutive deltas into one with the same effect
+        
+        Each voxel is kept once, with the value of its last write, so applying
+        the result equals applying the deltas in order.
         
         Args:
-            delta: Delta dictionary
-            compress: Whether to gzip compress (for large deltas)
+            deltas: Delta objects with "voxels" columns, in order
             
         Returns:
-            tuple: (encoded_string, size_in_bytes)
+            Dict: Single delta object; action and metadata of the last delta
         """
-        json_str = json.dumps(delta, separators=(',', ':'))  # Compact JSON
+        if len(deltas) == 1:
+            return deltas[0]
         
-        if compress and len(json_str) > 10000:  # Compress if > 10KB
-            compressed = gzip.compress(json_str.encode('utf-8'))
-            # Store as base64 for text column
-            import base64
-            encoded = base64.b64encode(compressed).decode('ascii')
-            return f"gzip:{encoded}", len(compressed)
+        merged = {
+            name: np.concatenate([delta["voxels"][name] for delta in deltas])
+            for name in VOXEL_FIELDS
+        }
+        coords = tuple(merged[name].astype(np.int64) for name in COORD_FIELDS)
+        if len(coords[0]):
+            # Linearize within the bounding box; the first hit in the reversed stream is the last write
+            lows = [axis.min() for axis in coords]
+            extents = [int(axis.max() - low) + 1 for axis, low in zip(coords, lows)]
+            linear = np.ravel_multi_index(
+                tuple(axis - low for axis, low in zip(coords, lows)), extents
+            )
+            keep = len(linear) - 1 - np.unique(linear[::-1], return_index=True)[1]
+            merged = {name: column[keep] for name, column in merged.items()}
         
-        return json_str, len(json_str)
+        last = deltas[-1]
+        return {
+            "action": last.get("action"),
+            "voxels": merged,
+            "voxel_count": len(merged["x"]),
+            "metadata": last.get("metadata") or {}
+        }
+    
+    @staticmethod
+    def _pack_delta(delta: Dict) -> bytes:
+        """
+        Serialize a delta to the uncompressed binary layout (see _pack_delta_parts)
+        """
+        return b"".join(DeltaManager._pack_delta_parts(delta))
     
     @staticmethod
-    def decode_delta(encoded_str: str) -> Dict:
+    def _pack_delta_parts(delta: Dict) -> List[Any]:
         """
-        Decode delta from stored string
+        Serialize a delta to the uncompressed binary layout, as a list of buffers
+        
+        Layout: 4-byte header length, JSON header (action, metadata, field
+        names, voxel count, bounding box), then the coordinates followed by the
+        value columns. Each voxel's position is linearized within the delta's
+        own bounding box, the positions are sorted, and the gaps between them
+        stored as varints - a brush stroke is a dense blob, so nearly every gap
+        fits one byte. Label values use the narrowest of LABEL_DTYPES that
+        holds them.
+        
+        The parts are returned unjoined so callers can stream them straight
+        into a compressor without first building the whole payload.
         
         Args:
-            encoded_str: Encoded delta string (possibly compressed)
+            delta: Delta dictionary, with "voxels" columns or wire format "voxel_changes"
             
         Returns:
-            Dict: Delta object
+            list: Bytes-like parts of the binary payload, in order
+        """
+        voxels = delta.get("voxels")
+        if voxels is None:
+            voxels = DeltaManager.to_voxel_columns(delta.get("voxel_changes", []))
+        fields = list(VOXEL_FIELDS)
+        value_fields = [name for name in fields if name not in COORD_FIELDS]
+        count = len(voxels["x"])
+        
+        x, y, z = (np.asarray(voxels[name], dtype=np.int64) for name in COORD_FIELDS)
+        origin = [int(axis.min()) if count else 0 for axis in (x, y, z)]
+        width = int(x.max()) - origin[0] + 1 if count else 1
+        height = int(y.max()) - origin[1] + 1 if count else 1
+        linear = ((z - origin[2]) * height + (y - origin[1])) * width + (x - origin[0])
+        
+        # Stable sort keeps repeated coordinates in edit order, so the last write still wins
+        order = np.argsort(linear, kind="stable")
+        gaps = _varint_encode(np.diff(linear[order], prepend=0))
+        
+        values = np.stack([np.asarray(voxels[name])[order] for name in value_fields])
+        value_dtype = LABEL_DTYPES[-1]
+        if values.size == 0:
+            value_dtype = LABEL_DTYPES[0]
+        else:
+            low, high = values.min(), values.max()
+            for dtype in LABEL_DTYPES:
+                if low >= np.iinfo(dtype).min and high <= np.iinfo(dtype).max:
+                    value_dtype = dtype
+                    break
+        
+        header = orjson.dumps({
+            "action": delta.get("action"),
+            "metadata": delta.get("metadata", {}),
+            "fields": fields,
+            "count": count,
+            "coords": "linear",
+            "origin": origin,
+            "extent": [width, height],
+            "coord_bytes": gaps.nbytes,
+            "value_dtype": value_dtype.str,
+        }, option=orjson.OPT_NON_STR_KEYS)
+        return [
+            struct.pack("<I", len(header)), header,
+            gaps, values.astype(value_dtype)
+        ]
+    
+    @staticmethod
+    def encode_delta(delta: Dict, compress: bool = True) -> tuple[bytes, int]:
         """
-        if encoded_str.startswith("gzip:"):
+        Encode delta to compact binary, optionally zstd-compressed
+        
+        Args:
+            delta: Delta dictionary, with "voxels" columns or wire format "voxel_changes"
+            compress: Whether to compress (payloads over COMPRESS_MIN_SIZE)
+            
+        Returns:
+            tuple: (encoded_bytes, size_in_bytes)
+        """
+        payload = DeltaManager._join_parts([SOA_MAGIC] + DeltaManager._pack_delta_parts(delta), compress)
+        return payload, len(payload)
+    
+    @staticmethod
+    def _join_parts(parts: List[Any], compress: bool) -> bytes:
+        """
+        Join payload parts, streaming them straight into zstd when compressing
+        """
+        size = sum(memoryview(part).nbytes for part in parts)
+        
+        if compress and size > DeltaManager.COMPRESS_MIN_SIZE:
+            compressor = _zstd_compressor().compressobj(size=size)
+            return b"".join([compressor.compress(part) for part in parts] + [compressor.flush()])
+        
+        return b"".join(parts)
+    
+    @staticmethod
+    def train_dictionary(deltas: List[Dict], dict_size: int = 16 * 1024) -> bytes:
+        """
+        Train a zstd dictionary from representative deltas
+        
+        Write the result to a file and point DELTA_ZSTD_DICT at it.
+        
+        Args:
+            deltas: Sample delta dictionaries (a few hundred or more)
+            dict_size: Target dictionary size in bytes
+            
+        Returns:
+            bytes: Dictionary data
+        """
+        samples = [DeltaManager._pack_delta(delta) for delta in deltas]
+        return zstandard.train_dictionary(dict_size, samples).as_bytes()
+    
+    @staticmethod
+    def decode_delta(encoded: Union[bytes, str]) -> Dict:
+        """
+        Decode delta from stored bytes
+        
+        Args:
+            encoded: Stored delta - binary, or legacy text (possibly compressed)
+            
+        Returns:
+            Dict: Delta object - "voxels" columns for binary deltas, or the
+            original "voxel_changes" list for legacy JSON deltas
+        """
+        if isinstance(encoded, (bytes, bytearray, memoryview)):
+            encoded = bytes(encoded)
+            if encoded.startswith(ZSTD_MAGIC):
+                encoded = _zstd_decompressor().decompress(encoded)
+            if encoded.startswith(SOA_MAGIC):
+                return DeltaManager._unpack_delta(memoryview(encoded)[len(SOA_MAGIC):])
+            # Text delta stored before delta_data became binary
+            encoded = encoded.decode('utf-8')
+        
+        if encoded.startswith("soa"):
+            prefix, payload = encoded.split(":", 1)
+            payload = base64.b64decode(payload)
+            if prefix == "soa+zstd":
+                payload = _zstd_decompressor().decompress(payload)
+            elif prefix == "soa+gzip":
+                payload = gzip.decompress(payload)
+            return DeltaManager._unpack_delta(payload)
+        
+        # Legacy JSON deltas
+        if encoded.startswith("gzip:"):
             # Decompress gzipped delta
-            import base64
-            compressed = base64.b64decode(encoded_str[5:])
+            compressed = base64.b64decode(encoded[5:])
             json_str = gzip.decompress(compressed).decode('utf-8')
         else:
-            json_str = encoded_str
+            json_str = encoded
         
         return json.loads(json_str)
     
     @staticmethod
-    def should_create_snapshot(session_edits_count: int, minutes_since_last: int) -> bool:
+    def _unpack_delta(payload) -> Dict:
+        """
+        Unpack an uncompressed binary delta payload (inverse of _pack_delta)
+        """
+        (header_len,) = struct.unpack_from("<I", payload)
+        header = orjson.loads(payload[4:4 + header_len])
+        fields = header["fields"]
+        offset = 4 + header_len
+        
+        if header.get("coords") == "linear":
+            count = header["count"]
+            width, height = header["extent"]
+            gaps = np.frombuffer(payload, dtype=np.uint8, count=header["coord_bytes"], offset=offset)
+            linear = np.cumsum(_varint_decode(gaps), dtype=np.int64)
+            offset += gaps.nbytes
+            
+            x0, y0, z0 = header["origin"]
+            plane, row_x = np.divmod(linear, width)
+            z, row_y = np.divmod(plane, height)
+            coords = (row_x + x0, row_y + y0, z + z0)
+            
+            value_fields = [name for name in fields if name not in COORD_FIELDS]
+            values = np.frombuffer(payload, dtype=np.dtype(header["value_dtype"]), offset=offset)
+            values = values.reshape(len(value_fields), count)
+            
+            voxels = {name: coords[i].astype(VOXEL_DTYPE) for i, name in enumerate(COORD_FIELDS)}
+            voxels.update({name: values[i] for i, name in enumerate(value_fields)})
+        elif header.get("coords") == "delta":
+            # Per-axis coordinate differences, before positions were linearized
+            count = header["count"]
+            coord_dtype = np.dtype(header["coord_dtype"])
+            coord_deltas = np.frombuffer(
+                payload, dtype=coord_dtype, count=len(COORD_FIELDS) * count, offset=offset
+            ).reshape(len(COORD_FIELDS), count)
+            coords = np.cumsum(coord_deltas, axis=1, dtype=VOXEL_DTYPE)
+            offset += coord_deltas.nbytes
+            
+            value_fields = [name for name in fields if name not in COORD_FIELDS]
+            # Deltas written before labels were narrowed always used int32
+            value_dtype = np.dtype(header.get("value_dtype", VOXEL_DTYPE))
+            values = np.frombuffer(payload, dtype=value_dtype, offset=offset)
+            values = values.reshape(len(value_fields), count)
+            
+            voxels = {name: coords[i] for i, name in enumerate(COORD_FIELDS)}
+            voxels.update({name: values[i] for i, name in enumerate(value_fields)})
+        else:
+            # Early binary deltas: plain int32 columns in field order
+            columns = np.frombuffer(payload, dtype=VOXEL_DTYPE, offset=offset)
+            columns = columns.reshape(len(fields), -1)
+            voxels = {name: columns[i] for i, name in enumerate(fields)}
+        
+        return {
+            "action": header["action"],
+            "voxels": voxels,
+            "voxel_count": len(voxels["x"]),
+            "metadata": header["metadata"]
+        }
+    
+    @staticmethod
+    def should_create_snapshot(session_edits_count: int, seconds_since_last: int) -> bool:
         """
         Determine if a snapshot should be created
         
         Args:
             session_edits_count: Number of deltas since last snapshot
-            minutes_since_last: Minutes since last snapshot
+            seconds_since_last: Seconds since last snapshot
             
         Returns:
             bool: True if snapshot should be created
         """
         return (
             session_edits_count >= DeltaManager.SNAPSHOT_INTERVAL_DELTAS or
-            minutes_since_last >= DeltaManager.SNAPSHOT_INTERVAL_MINUTES
+            seconds_since_last >= DeltaManager.SNAPSHOT_INTERVAL_SECONDS
         )
     
     @staticmethod
@@ -112,9 +486,51 @@ class DeltaManager:
         Returns:
             Modified array (in-place modification)
         """
-        for change in delta['voxel_changes']:
-            x, y, z = change['x'], change['y'], change['z']
-            segmentation_array[x, y, z] = change['new']
+        voxels = delta.get('voxels')
+        if voxels is None:
+            # Legacy JSON deltas - convert once, then share the vectorized path
+            voxels = DeltaManager.to_voxel_columns(delta['voxel_changes'])
+        
+        # One vectorized scatter; repeated coordinates are assigned in order, so the last write wins
+        segmentation_array[voxels['x'], voxels['y'], voxels['z']] = voxels['new']
+        return segmentation_array
+    
+    @staticmethod
+    def apply_deltas_to_array(segmentation_array, deltas: List[Dict]):
+        """
+        Apply a sequence of deltas to a numpy array with a single scatter
+        
+        All writes are merged first and only the last write to each voxel is
+        kept, so the array is touched once however many deltas there are.
+        
+        Args:
+            segmentation_array: numpy array of segmentation
+            deltas: List of delta objects to apply in order
+            
+        Returns:
+            Modified array (in-place modification)
+        """
+        if not deltas:
+            return segmentation_array
+        if len(deltas) == 1:
+            # Nothing to merge - skip the concatenate and the dedup sort
+            return DeltaManager.apply_delta_to_array(segmentation_array, deltas[0])
+        
+        columns = [
+            delta['voxels'] if 'voxels' in delta
+            else DeltaManager.to_voxel_columns(delta['voxel_changes'])
+            for delta in deltas
+        ]
+        coords = tuple(
+            np.concatenate([voxels[name] for voxels in columns])
+            for name in COORD_FIELDS
+        )
+        new_values = np.concatenate([voxels['new'] for voxels in columns])
+        
+        # C-order flat index per write; the first hit in the reversed stream is the last write
+        linear = np.ravel_multi_index(coords, segmentation_array.shape)
+        linear_unique, last = np.unique(linear[::-1], return_index=True)
+        np.put(segmentation_array, linear_unique, new_values[::-1][last])
         
         return segmentation_array
     
@@ -130,13 +546,107 @@ class DeltaManager:
         Returns:
             Reconstructed segmentation array
         """
-        import numpy as np
         result = np.copy(base_array)
+        return DeltaManager.apply_deltas_to_array(result, deltas)
+    
+    @staticmethod
+    def snapshot_chunks(array, header: Optional[Dict] = None) -> List[bytes]:
+        """
+        Encode a dense volume as a gzip-encoded .nrrd for snapshot storage
+        
+        Label maps are long runs of the same value, so even the fastest gzip
+        level shrinks them many times over, and the result is still a plain
+        .nrrd that Slicer and the download endpoints can use as-is.
+        
+        The file comes back as the pieces the encoder produced, so it can be
+        written to storage without first being joined into one buffer.
+        
+        Args:
+            array: Dense segmentation array
+            header: Optional .nrrd header (spacing, origin, ...) to keep
+            
+        Returns:
+            List[bytes]: .nrrd file data, in order
+        """
+        import nrrd
+        header = dict(header or {})
+        header["encoding"] = "gzip"
+        output = _ChunkSink()
+        nrrd.write(output, array, header, compression_level=DeltaManager.SNAPSHOT_COMPRESSION_LEVEL)
+        return output.chunks
+    
+    @staticmethod
+    def snapshot_compress(array, header: Optional[Dict] = None) -> bytes:
+        """
+        Encode a dense volume as gzip-encoded .nrrd file data
+        
+        Args:
+            array: Dense segmentation array
+            header: Optional .nrrd header (spacing, origin, ...) to keep
+            
+        Returns:
+            bytes: .nrrd file data
+        """
+        return b"".join(DeltaManager.snapshot_chunks(array, header))
+    
+    @staticmethod
+    def snapshot_decompress(data: Union[bytes, BinaryIO]):
+        """
+        Decode .nrrd file data (any encoding) into a dense array
         
-        for delta in deltas:
-            DeltaManager.apply_delta_to_array(result, delta)
+        Given an open file, pynrrd reads and decompresses it in large chunks,
+        so the compressed payload is never held in memory as a whole.
         
-        return result
+        Args:
+            data: .nrrd file data, or a binary file positioned at its start
+            
+        Returns:
+            tuple: (array, header)
+        """
+        import nrrd
+        file_obj = BytesIO(data) if isinstance(data, (bytes, bytearray, memoryview)) else data
+        header = nrrd.read_header(file_obj)
+        return nrrd.read_data(header, file_obj), header
+    
+    @staticmethod
+    def ensure_compressed_nrrd(data: bytes) -> bytes:
+        """
+        Re-encode .nrrd file data with gzip if it is stored raw
+        
+        Raw payloads are gzipped as they are, in one pass, instead of being
+        decoded into an array and written out again.
+        
+        Args:
+            data: .nrrd file data
+            
+        Returns:
+            bytes: The same data if already compressed or not an .nrrd, otherwise
+            a gzip-encoded copy
+        """
+        import nrrd
+        file_obj = BytesIO(data)
+        try:
+            header = nrrd.read_header(file_obj)
+        except nrrd.NRRDError:
+            # Not ours to validate - store it as given, as before
+            return data
+        if header.get("encoding", "raw").lower() != "raw":
+            return data
+        
+        header_end = file_obj.tell()
+        if any(field in header for field in _NRRD_LAYOUT_FIELDS):
+            # Detached or offset data - let pynrrd work out where the voxels are
+            array, header = DeltaManager.snapshot_decompress(data)
+            return DeltaManager.snapshot_compress(array, header)
+        
+        # The raw payload is exactly the sample bytes, so it can be deflated as-is
+        header_bytes = _NRRD_RAW_ENCODING.sub(b"encoding: gzip", data[:header_end], count=1)
+        compressor = zlib.compressobj(DeltaManager.SNAPSHOT_COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+        return b"".join((
+            header_bytes,
+            compressor.compress(memoryview(data)[header_end:]),
+            compressor.flush(),
+        ))
     
     @staticmethod
     def estimate_delta_size(voxel_count: int) -> int:
@@ -149,9 +659,114 @@ class DeltaManager:
         Returns:
             int: Estimated size in bytes
         """
-        # Rough estimate: each voxel change ~40 bytes in JSON
-        # {"x":123,"y":45,"z":78,"old":0,"new":1} = ~38 chars
-        return voxel_count * 40
+        # Each voxel is a varint gap between sorted bounding-box positions (one
+        # byte in a dense stroke, up to about three when scattered) plus its
+        # label, narrowed to uint8 in practice; two gap bytes is a middle estimate
+        return voxel_count * 3
+
+
+def now_epoch() -> int:
+    """Current Unix time in whole seconds - all snapshot cadence needs"""
+    return time.time_ns() // 1_000_000_000
+
+
+class SessionCounters:
+    """
+    Deltas and time since the last snapshot, per collaborative session
+    
+    Lets the snapshot check after each delta batch skip counting
+    segmentation_edits. Kept in Redis when configured so every worker sees
+    the same count, otherwise in-process. A session that isn't tracked yet
+    (first batch, restart) reports None and the caller seeds it from the DB.
+    """
+    # Redis entries outlive any realistic session, then clean themselves up
+    REDIS_TTL_SECONDS = 24 * 60 * 60
+    
+    def __init__(self):
+        # session_id -> [deltas since snapshot, snapshot time as epoch seconds]
+        self._counters: Dict[int, List[int]] = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _key(session_id: int) -> str:
+        return f"session:{session_id}:snapshot"
+    
+    def increment(self, session_id: int, deltas: int = 1) -> Optional[Tuple[int, int]]:
+        """
+        Count new deltas for a session
+        
+        Args:
+            session_id: Collaborative session ID
+            deltas: Number of deltas just saved
+            
+        Returns:
+            tuple: (deltas since last snapshot, seconds since last snapshot),
+            or None if the session isn't tracked yet
+        """
+        client = get_sync_redis()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                pipe.hget(self._key(session_id), "since")
+                pipe.hincrby(self._key(session_id), "deltas", deltas)
+                since, count = pipe.execute()
+            except RedisError as e:
+                logger.warning(f"Failed to update snapshot counter for session {session_id}: {e}")
+                return None
+            # "since" is only written by seed, so without it the count is meaningless
+            if since is None:
+                return None
+            # float() also reads "since" values written before they were whole seconds
+            return count, now_epoch() - int(float(since))
+        
+        with self._lock:
+            entry = self._counters.get(session_id)
+            if entry is None:
+                return None
+            entry[0] += deltas
+            return entry[0], now_epoch() - entry[1]
+    
+    def seed(self, session_id: int, deltas: int, since: Optional[int] = None):
+        """
+        Start (or restart) tracking a session
+        
+        Args:
+            session_id: Collaborative session ID
+            deltas: Deltas saved since the last snapshot
+            since: Epoch seconds of the last snapshot (or session start); defaults to now
+        """
+        if since is None:
+            since = now_epoch()
+        
+        client = get_sync_redis()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                pipe.hset(self._key(session_id), mapping={"deltas": deltas, "since": since})
+                pipe.expire(self._key(session_id), self.REDIS_TTL_SECONDS)
+                pipe.execute()
+            except RedisError as e:
+                logger.warning(f"Failed to seed snapshot counter for session {session_id}: {e}")
+            return
+        
+        with self._lock:
+            self._counters[session_id] = [deltas, since]
+    
+    def discard(self, session_id: int):
+        """Stop tracking a session once it has ended"""
+        client = get_sync_redis()
+        if client is not None:
+            try:
+                client.delete(self._key(session_id))
+            except RedisError as e:
+                logger.warning(f"Failed to drop snapshot counter for session {session_id}: {e}")
+            return
+        
+        with self._lock:
+            self._counters.pop(session_id, None)
+
+
+session_counters = SessionCounters()
 
 
 # Storage decision logic example
@@ -173,14 +788,14 @@ def save_edit_smart(storage_service, segmentation_id: int, edit_type: str,
     
     if edit_type == 'delta':
         # It's a delta - encode and decide storage
-        delta_str, size = DeltaManager.encode_delta(data, compress=True)
+        delta_bytes, size = DeltaManager.encode_delta(data, compress=True)
         
         if size < DeltaManager.INLINE_DELTA_MAX_SIZE:
             # Store inline in database
-            return None, delta_str, size
+            return None, delta_bytes, size
         else:
             # Save as file (rare - very large delta)
-            file_obj = BytesIO(delta_str.encode('utf-8'))
+            file_obj = BytesIO(delta_bytes)
             file_path = storage_service.save_file(
                 file_data=file_obj,
                 file_type='delta',
@@ -1,44 +1,89 @@
-from sqlalchemy.orm import Session
-from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session, joinedload, raiseload, selectinload
+from typing import Dict, Optional, Tuple
 
-from models import User, Project, Segmentation, ProjectCollaborator, UserRole
+from models import User, Project, Segmentation, ProjectCollaborator, UserRole, CollaborativeSession
+
+
+# Roles allowed each kind of access; hashed membership, nothing allocated per check
+_EDIT_ROLES = frozenset({UserRole.OWNER, UserRole.EDITOR})
+_COMMENT_ROLES = frozenset({UserRole.OWNER, UserRole.EDITOR, UserRole.REVIEWER})
+
+
+def permission_query_options():
+    """
+    Loader options for Project queries whose result is passed to PermissionService
+    
+    Loads the collaborators alongside the project, so permission checks
+    never go back to the database, and makes any other relationship access
+    on the project raise instead of silently issuing a lazy load.
+    """
+    return [selectinload(Project.collaborators), raiseload('*')]
+
+
+def _collab_for(project: Project, user_id: int) -> Optional[ProjectCollaborator]:
+    """
+    Find the user's collaborator entry among the project's loaded collaborators
+    """
+    for collaborator in project.collaborators:
+        if collaborator.user_id == user_id:
+            return collaborator
+    return None
 
 
 class PermissionService:
     """
     Service for checking user permissions on projects and segmentations.
     Centralizes all permission logic.
+    
+    Checks read project.collaborators and never query on their own, so
+    load projects with permission_query_options() (or selectinload
+    Project.collaborators when the project comes through another entity).
     """
     
     def __init__(self, db: Session):
         self.db = db
+        # (user_id, project_id) -> effective role, or None if the user has no access.
+        # Services are built per request, so this never outlives a role change for long.
+        self._role_cache: Dict[Tuple[int, int], Optional[UserRole]] = {}
     
-    def can_edit(self, user: User, project: Project) -> bool:
+    def _role(self, user: User, project: Project) -> Optional[UserRole]:
         """
-        Check if user can edit a project
+        Get the user's effective role in a project, resolving each pair once
+        
+        Owners get UserRole.OWNER; everyone else gets their collaborator role.
         
         Args:
             user: User object
             project: Project object
             
         Returns:
-            bool: True if user can edit
+            UserRole or None if user has no access
         """
-        # Owner can always edit
         if project.owner_id == user.id:
-            return True
-        
-        # Check if user is a collaborator with edit permissions
-        collaborator = self.db.query(ProjectCollaborator).filter(
-            ProjectCollaborator.project_id == project.id,
-            ProjectCollaborator.user_id == user.id
-        ).first()
+            return UserRole.OWNER
         
-        if collaborator:
-            # EDITOR and OWNER roles can edit
-            return collaborator.role in [UserRole.EDITOR, UserRole.OWNER]
+        key = (user.id, project.id)
+        try:
+            return self._role_cache[key]
+        except KeyError:
+            collaborator = _collab_for(project, user.id)
+            role = self._role_cache[key] = collaborator.role if collaborator else None
+            return role
+    
+    def can_edit(self, user: User, project: Project) -> bool:
+        """
+        Check if user can edit a project
         
-        return False
+        Args:
+            user: User object
+            project: Project object
+            
+        Returns:
+            bool: True if user can edit
+        """
+        # EDITOR and OWNER roles can edit
+        return self._role(user, project) in _EDIT_ROLES
     
     def can_view(self, user: User, project: Project) -> bool:
         """
@@ -51,17 +96,8 @@ class PermissionService:
         Returns:
             bool: True if user can view
         """
-        # Owner can always view
-        if project.owner_id == user.id:
-            return True
-        
-        # Check if user is a collaborator (all roles can view)
-        collaborator = self.db.query(ProjectCollaborator).filter(
-            ProjectCollaborator.project_id == project.id,
-            ProjectCollaborator.user_id == user.id
-        ).first()
-        
-        return collaborator is not None
+        # Owner and every collaborator role can view
+        return self._role(user, project) is not None
     
     def can_start_session(self, user: User, segmentation: Segmentation) -> bool:
         """
@@ -99,21 +135,8 @@ class PermissionService:
         Returns:
             bool: True if user can comment
         """
-        # Owner can always comment
-        if project.owner_id == user.id:
-            return True
-        
-        # Check collaborator role
-        collaborator = self.db.query(ProjectCollaborator).filter(
-            ProjectCollaborator.project_id == project.id,
-            ProjectCollaborator.user_id == user.id
-        ).first()
-        
-        if collaborator:
-            # EDITOR, REVIEWER, and OWNER can comment
-            return collaborator.role in [UserRole.EDITOR, UserRole.REVIEWER, UserRole.OWNER]
-        
-        return False
+        # EDITOR, REVIEWER, and OWNER can comment
+        return self._role(user, project) in _COMMENT_ROLES
     
     def can_delete(self, user: User, project: Project) -> bool:
         """
@@ -154,17 +177,7 @@ class PermissionService:
         Returns:
             UserRole or None if user has no access
         """
-        # Check if owner
-        if project.owner_id == user.id:
-            return UserRole.OWNER
-        
-        # Check collaborator role
-        collaborator = self.db.query(ProjectCollaborator).filter(
-            ProjectCollaborator.project_id == project.id,
-            ProjectCollaborator.user_id == user.id
-        ).first()
-        
-        return collaborator.role if collaborator else None
+        return self._role(user, project)
     
     def can_join_session(self, user: User, session_id: int) -> bool:
         """
@@ -177,9 +190,15 @@ class PermissionService:
         Returns:
             bool: True if user can join
         """
-        from models import CollaborativeSession
-        
-        session = self.db.query(CollaborativeSession).get(session_id)
+        # Session, segmentation, project and collaborators in one go
+        session = self.db.scalars(
+            select(CollaborativeSession).options(
+                joinedload(CollaborativeSession.segmentation)
+                .joinedload(Segmentation.project)
+                .selectinload(Project.collaborators),
+                raiseload('*')
+            ).where(CollaborativeSession.id == session_id)
+        ).first()
         if not session:
             return False
         
@@ -1,16 +1,41 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import desc, func, insert, or_, select, text
 from typing import BinaryIO, List, Dict, Optional, Tuple
 from datetime import datetime
 from io import BytesIO
+import os
+from concurrent.futures import ThreadPoolExecutor
 import json
+import hashlib
 
 from models import (
     Segmentation, SegmentationVersion, SegmentationEdit, 
-    EditType, User, CollaborativeSession
+    EditType, User, CollaborativeSession, SessionStatus
 )
 from api.storage_service import get_storage_service
-from .delta_manager import DeltaManager
+from .delta_manager import DeltaManager, now_epoch, session_counters
+
+
+# zlib and zstd release the GIL, so base decompression and delta decoding run in parallel
+_reconstruct_executor = ThreadPoolExecutor(
+    max_workers=min(8, (os.cpu_count() or 1) + 1),  # one spare for the base
+    thread_name_prefix="reconstruct"
+)
+# Below this many deltas, handing them to the pool costs more than it saves
+PARALLEL_DECODE_MIN_DELTAS = 16
+
+# Columns build_delta_edit fills in, written by save_delta_edits' bulk insert. created_at
+# is left to the database, like every other edit and the session's started_at, so
+# replay never compares timestamps from two clocks
+_DELTA_EDIT_FIELDS = (
+    "segmentation_id", "edit_type", "file_path", "delta_data", "data_size_bytes",
+    "voxels_modified", "created_by_id", "session_id", "change_description"
+)
+# Rows per INSERT statement when a batch is split up
+INSERT_PAGE_SIZE = 1000
+# Delta commits return before the WAL reaches disk; a crash can lose the last
+# few hundred ms of deltas, which clients still hold and can resend
+DELTA_ASYNC_COMMIT = os.getenv("DELTA_ASYNC_COMMIT", "true").lower() == "true"
 
 
 class SegmentationService:
@@ -48,21 +73,105 @@ class SegmentationService:
             Tuple of (SegmentationEdit, SegmentationVersion or None)
         """
         # Get segmentation
-        segmentation = self.db.query(Segmentation).filter(
-            Segmentation.id == segmentation_id
-        ).first()
+        segmentation = self.db.get(Segmentation, segmentation_id)
         
         if not segmentation:
             raise ValueError(f"Segmentation {segmentation_id} not found")
         
+        # Label volumes are mostly long runs of one value - never store them raw
+        data = self.delta_manager.ensure_compressed_nrrd(file_data.read())
+        
         # Save file to storage
-        file_path = self.storage.save_file(
-            file_data=file_data,
+        file_path, file_hash = self.store_file(
+            [data],
             file_type='nrrd',
             segmentation_id=segmentation_id,
             metadata={'user_id': user_id, 'type': 'full_save'}
         )
         
+        return self.record_full_save(
+            segmentation_id=segmentation_id,
+            file_path=file_path,
+            user_id=user_id,
+            change_description=change_description,
+            create_version=create_version,
+            session_id=session_id,
+            file_hash=file_hash
+        )
+    
+    def store_file(
+        self,
+        chunks: List[bytes],
+        file_type: str,
+        segmentation_id: int,
+        metadata: dict = None
+    ) -> Tuple[str, str]:
+        """
+        Save file data to storage, unless the segmentation already has an
+        identical stored file (an unchanged re-save, or a snapshot right after
+        a full save), in which case that file is reused
+        
+        Args:
+            chunks: File data, in order
+            file_type: Type of file ('nrrd', 'snapshot', ...)
+            segmentation_id: ID of segmentation
+            metadata: Optional metadata (currently for logging only)
+            
+        Returns:
+            Tuple of (relative file path, content hash)
+        """
+        digest = hashlib.blake2b(digest_size=32)
+        for chunk in chunks:
+            digest.update(chunk)
+        file_hash = digest.hexdigest()
+        
+        existing_path = self.db.scalar(
+            select(SegmentationEdit.file_path).where(
+                SegmentationEdit.segmentation_id == segmentation_id,
+                SegmentationEdit.file_hash == file_hash,
+                SegmentationEdit.file_path.isnot(None)
+            ).limit(1)
+        )
+        if existing_path and self.storage.file_exists(existing_path):
+            return existing_path, file_hash
+        
+        file_path = self.storage.save_file_stream(
+            chunks,
+            file_type=file_type,
+            segmentation_id=segmentation_id,
+            metadata=metadata
+        )
+        return file_path, file_hash
+    
+    def record_full_save(
+        self,
+        segmentation_id: int,
+        file_path: str,
+        user_id: int,
+        change_description: Optional[str] = None,
+        create_version: bool = True,
+        session_id: Optional[int] = None,
+        file_hash: Optional[str] = None
+    ) -> Tuple[SegmentationEdit, Optional[SegmentationVersion]]:
+        """
+        Record an .nrrd file already written to storage as a full save
+        
+        Args:
+            segmentation_id: ID of segmentation
+            file_path: Relative storage path of the saved file
+            user_id: ID of user saving
+            change_description: Optional description of changes
+            create_version: Whether to create a new version entry
+            session_id: Optional collaborative session ID
+            file_hash: Content hash from store_file, if the file went through it
+            
+        Returns:
+            Tuple of (SegmentationEdit, SegmentationVersion or None)
+        """
+        segmentation = self.db.get(Segmentation, segmentation_id)
+        if not segmentation:
+            raise ValueError(f"Segmentation {segmentation_id} not found")
+        
         file_size = self.storage.get_file_size(file_path)
         
         # Create edit record
@@ -70,16 +179,20 @@ class SegmentationService:
             segmentation_id=segmentation_id,
             edit_type=EditType.FULL_SAVE,
             file_path=file_path,
+            file_hash=file_hash,
             data_size_bytes=file_size,
             created_by_id=user_id,
             session_id=session_id,
             change_description=change_description
         )
         self.db.add(edit)
+        self.db.flush()
         
         # Update segmentation metadata
         segmentation.updated_at = datetime.utcnow()
         segmentation.last_editor_id = user_id
+        segmentation.latest_full_save_edit_id = edit.id
+        segmentation.latest_full_save_path = file_path
         
         # Create version if requested
         version = None
@@ -125,15 +238,73 @@ class SegmentationService:
             SegmentationEdit record
         """
         # Get segmentation
-        segmentation = self.db.query(Segmentation).filter(
-            Segmentation.id == segmentation_id
-        ).first()
+        segmentation = self.db.get(Segmentation, segmentation_id)
         
         if not segmentation:
             raise ValueError(f"Segmentation {segmentation_id} not found")
         
+        if session_id:
+            self._lock_active_session(session_id)
+        edit = self.build_delta_edit(segmentation_id, delta, user_id, session_id)
+        self._defer_delta_flush()
+        self.db.add(edit)
+        
+        # Update segmentation metadata
+        segmentation.updated_at = datetime.utcnow()
+        segmentation.last_editor_id = user_id
+        
+        self.db.commit()
+        self.db.refresh(edit)
+        
+        # Check if snapshot is needed
+        if session_id:
+            self._check_and_create_snapshot(segmentation_id, session_id, user_id)
+        
+        return edit
+    
+    def _lock_active_session(self, session_id: int):
+        """
+        Take a shared lock on a session row, so end_session (FOR UPDATE) waits
+        for this transaction and anything written after the end is refused
+        
+        Raises:
+            ValueError: If the session is missing or no longer active
+        """
+        session = self.db.get(
+            CollaborativeSession, session_id,
+            with_for_update={"read": True}, populate_existing=True
+        )
+        if session is None or session.status != SessionStatus.ACTIVE:
+            raise ValueError(f"Session {session_id} is not active")
+    
+    def _defer_delta_flush(self):
+        """Let the current transaction commit without waiting for its WAL flush (PostgreSQL only)"""
+        if DELTA_ASYNC_COMMIT and self.db.get_bind().dialect.name == "postgresql":
+            # SET LOCAL ends with the transaction, so full saves stay synchronous
+            self.db.execute(text("SET LOCAL synchronous_commit = off"))
+    
+    def build_delta_edit(
+        self,
+        segmentation_id: int,
+        delta: Dict,
+        user_id: int,
+        session_id: Optional[int] = None
+    ) -> SegmentationEdit:
+        """
+        Encode a delta into an unsaved SegmentationEdit
+        Does not touch the database, so it is safe to call from the WebSocket loop
+        
+        Args:
+            segmentation_id: ID of segmentation
+            delta: Delta object with voxel changes
+            user_id: ID of user making changes
+            session_id: Collaborative session ID
+            
+        Returns:
+            Transient SegmentationEdit record
+        """
         # Encode delta
-        delta_str, size = self.delta_manager.encode_delta(delta, compress=True)
+        delta_bytes, size = self.delta_manager.encode_delta(delta, compress=True)
         
         # Determine storage method
         file_path = None
@@ -141,18 +312,17 @@ class SegmentationService:
         
         if size < DeltaManager.INLINE_DELTA_MAX_SIZE:
             # Store inline in database
-            delta_data = delta_str
+            delta_data = delta_bytes
         else:
             # Save as file (rare for large deltas)
-            file_obj = BytesIO(delta_str.encode('utf-8'))
+            file_obj = BytesIO(delta_bytes)
             file_path = self.storage.save_file(
                 file_data=file_obj,
                 file_type='delta',
                 segmentation_id=segmentation_id
             )
         
-        # Create edit record
-        edit = SegmentationEdit(
+        return SegmentationEdit(
             segmentation_id=segmentation_id,
             edit_type=EditType.DELTA,
             file_path=file_path,
@@ -163,20 +333,56 @@ class SegmentationService:
             voxels_modified=delta.get('voxel_count', len(delta.get('voxel_changes', []))),
             change_description=delta.get('metadata', {}).get('description')
         )
-        self.db.add(edit)
+    
+    def save_delta_edits(
+        self,
+        edits: List[SegmentationEdit],
+        check_snapshot: bool = True
+    ) -> Optional[int]:
+        """
+        Persist a batch of delta edits from one session with a single commit
+        
+        Args:
+            edits: Edits built by build_delta_edit, in arrival order
+            check_snapshot: Whether to create a due snapshot inline; callers
+                that pass False check snapshot_due themselves
+            
+        Returns:
+            Project ID of the edited segmentation, or None for an empty batch
+        """
+        if not edits:
+            return None
+        
+        last = edits[-1]
+        segmentation = self.db.get(Segmentation, last.segmentation_id)
+        
+        if not segmentation:
+            raise ValueError(f"Segmentation {last.segmentation_id} not found")
+        
+        if last.session_id:
+            self._lock_active_session(last.session_id)
+        self._defer_delta_flush()
+        # One multi-row INSERT (executemany) - no per-object unit-of-work bookkeeping
+        self.db.execute(
+            insert(SegmentationEdit).execution_options(insertmanyvalues_page_size=INSERT_PAGE_SIZE),
+            [{field: getattr(edit, field) for field in _DELTA_EDIT_FIELDS} for edit in edits]
+        )
         
         # Update segmentation metadata
         segmentation.updated_at = datetime.utcnow()
-        segmentation.last_editor_id = user_id
+        segmentation.last_editor_id = last.created_by_id
+        project_id = segmentation.project_id
         
         self.db.commit()
-        self.db.refresh(edit)
         
-        # Check if snapshot is needed
-        if session_id:
-            self._check_and_create_snapshot(segmentation_id, session_id, user_id)
+        # Check if snapshot is needed once per batch
+        if check_snapshot and last.session_id:
+            self._check_and_create_snapshot(
+                last.segmentation_id, last.session_id, last.created_by_id,
+                new_deltas=len(edits)
+            )
         
-        return edit
+        return project_id
     
     def create_version(
         self,
@@ -249,16 +455,21 @@ class SegmentationService:
             
             file_path = version.file_path
         else:
-            # Get latest full save
-            latest_edit = self.db.query(SegmentationEdit).filter(
-                SegmentationEdit.segmentation_id == segmentation_id,
-                SegmentationEdit.edit_type.in_([EditType.FULL_SAVE, EditType.SNAPSHOT])
-            ).order_by(desc(SegmentationEdit.created_at)).first()
-            
-            if not latest_edit:
-                raise ValueError(f"No data found for segmentation {segmentation_id}")
+            # Latest full save, straight from the segmentation's pointer
+            segmentation = self.db.get(Segmentation, segmentation_id)
+            file_path = segmentation.latest_full_save_path if segmentation else None
             
-            file_path = latest_edit.file_path
+            if not file_path:
+                # Rows from before the pointer existed fall back to the edit history
+                latest_edit = self.db.query(SegmentationEdit).filter(
+                    SegmentationEdit.segmentation_id == segmentation_id,
+                    SegmentationEdit.edit_type.in_([EditType.FULL_SAVE, EditType.SNAPSHOT])
+                ).order_by(desc(SegmentationEdit.created_at), desc(SegmentationEdit.id)).first()
+                
+                if not latest_edit:
+                    raise ValueError(f"No data found for segmentation {segmentation_id}")
+                
+                file_path = latest_edit.file_path
         
         # Read and return file data
         return self.storage.get_file(file_path)
@@ -278,7 +489,9 @@ class SegmentationService:
         Returns:
             List of SegmentationVersion records, ordered by version number (newest first)
         """
-        query = self.db.query(SegmentationVersion).filter(
+        query = self.db.query(SegmentationVersion).options(
+            joinedload(SegmentationVersion.creator)
+        ).filter(
             SegmentationVersion.segmentation_id == segmentation_id
         ).order_by(desc(SegmentationVersion.version_number))
         
@@ -313,7 +526,7 @@ class SegmentationService:
         if session_id:
             query = query.filter(SegmentationEdit.session_id == session_id)
         
-        return query.order_by(SegmentationEdit.created_at).all()
+        return query.order_by(SegmentationEdit.created_at, SegmentationEdit.id).all()
     
     def reconstruct_from_deltas(
         self,
@@ -322,7 +535,6 @@ class SegmentationService:
     ) -> bytes:
         """
         Reconstruct current segmentation state from base + deltas
-        Used when session ends to create final version
         
         Args:
             segmentation_id: ID of segmentation
@@ -331,100 +543,202 @@ class SegmentationService:
         Returns:
             bytes: Reconstructed .nrrd file data
         """
-        # Get last snapshot or full save before session started
-        session = self.db.query(CollaborativeSession).get(session_id)
-        if not session:
-            raise ValueError(f"Session {session_id} not found")
+        return b"".join(self.reconstruct_chunks(segmentation_id, session_id))
+    
+    def reconstruct_chunks(
+        self,
+        segmentation_id: int,
+        session_id: int
+    ) -> List[bytes]:
+        """
+        Reconstruct current segmentation state from base + deltas, as
+        .nrrd file data pieces ready for storage.save_file_stream
+        Used for snapshots and when session ends to create final version
         
-        base_edit = self.db.query(SegmentationEdit).filter(
+        Args:
+            segmentation_id: ID of segmentation
+            session_id: Session ID to reconstruct from
+            
+        Returns:
+            List[bytes]: Reconstructed .nrrd file data, in order
+        """
+        # Last full save or snapshot from before the session started (uncorrelated, like
+        # the snapshot lookup in _count_since_snapshot)
+        base_id = select(SegmentationEdit.id).where(
             SegmentationEdit.segmentation_id == segmentation_id,
             SegmentationEdit.edit_type.in_([EditType.FULL_SAVE, EditType.SNAPSHOT]),
-            SegmentationEdit.created_at <= session.started_at
-        ).order_by(desc(SegmentationEdit.created_at)).first()
+            SegmentationEdit.created_at <= select(CollaborativeSession.started_at)
+            .where(CollaborativeSession.id == session_id).scalar_subquery()
+        ).order_by(
+            desc(SegmentationEdit.created_at), desc(SegmentationEdit.id)
+        ).limit(1).correlate(None).scalar_subquery()
+        
+        # Base edit and the session's deltas in one round-trip. A batch shares one
+        # transaction timestamp, so id keeps its deltas in write order
+        edits = self.db.query(SegmentationEdit).filter(
+            SegmentationEdit.segmentation_id == segmentation_id,
+            or_(
+                SegmentationEdit.id == base_id,
+                (SegmentationEdit.session_id == session_id)
+                & (SegmentationEdit.edit_type == EditType.DELTA)
+            )
+        ).order_by(SegmentationEdit.created_at, SegmentationEdit.id).all()
         
+        base_edit = next((edit for edit in edits if edit.edit_type != EditType.DELTA), None)
         if not base_edit:
-            raise ValueError(f"No base state found for reconstruction")
+            raise ValueError(f"No base state found for reconstruction of session {session_id}")
+        
+        # Decompress the base in the background while the deltas decode
+        base_future = _reconstruct_executor.submit(self._load_base_array, base_edit.file_path)
+        delta_edits = [edit for edit in edits if edit.edit_type == EditType.DELTA]
+        if len(delta_edits) >= PARALLEL_DECODE_MIN_DELTAS:
+            # Decoding is independent per delta; map keeps them in apply order
+            deltas = list(_reconstruct_executor.map(self._decode_edit, delta_edits))
+        else:
+            deltas = [self._decode_edit(edit) for edit in delta_edits]
+        base_array, header = base_future.result()
         
-        # Load base array
-        import nrrd
-        base_data = self.storage.get_file(base_edit.file_path)
-        base_array, header = nrrd.reads(base_data)
+        self.delta_manager.apply_deltas_to_array(base_array, deltas)
         
-        # Get all deltas in session
-        deltas_edits = self.db.query(SegmentationEdit).filter(
-            SegmentationEdit.segmentation_id == segmentation_id,
-            SegmentationEdit.session_id == session_id,
-            SegmentationEdit.edit_type == EditType.DELTA
-        ).order_by(SegmentationEdit.created_at).all()
-        
-        # Apply deltas
-        for edit in deltas_edits:
-            delta_str = edit.delta_data or self.storage.get_file(edit.file_path).decode('utf-8')
-            delta = self.delta_manager.decode_delta(delta_str)
-            self.delta_manager.apply_delta_to_array(base_array, delta)
-        
-        # Convert back to .nrrd bytes
-        output = BytesIO()
-        nrrd.write(output, base_array, header)
-        return output.getvalue()
+        # Convert back to compressed .nrrd
+        return self.delta_manager.snapshot_chunks(base_array, header)
+    
+    def _decode_edit(self, edit: SegmentationEdit) -> Dict:
+        """
+        Decode a delta edit, stored inline or as a file
+        """
+        return self.delta_manager.decode_delta(
+            edit.delta_data or self.storage.get_file(edit.file_path)
+        )
+    
+    def _load_base_array(self, file_path: str):
+        """
+        Read and decode a stored .nrrd straight from its file
+        
+        Returns:
+            tuple: (array, header)
+        """
+        with self.storage.open_file(file_path) as base_file:
+            return self.delta_manager.snapshot_decompress(base_file)
     
     def _check_and_create_snapshot(
         self,
         segmentation_id: int,
         session_id: int,
-        user_id: int
+        user_id: int,
+        new_deltas: int = 1
     ):
         """
         Check if snapshot should be created and create it if needed
         Internal method called after applying deltas
         """
-        # Count deltas since last snapshot in this session
-        last_snapshot = self.db.query(SegmentationEdit).filter(
-            SegmentationEdit.segmentation_id == segmentation_id,
-            SegmentationEdit.session_id == session_id,
-            SegmentationEdit.edit_type == EditType.SNAPSHOT
-        ).order_by(desc(SegmentationEdit.created_at)).first()
+        if self.snapshot_due(segmentation_id, session_id, new_deltas):
+            self.create_snapshot(segmentation_id, session_id, user_id)
+    
+    def snapshot_due(self, segmentation_id: int, session_id: int, new_deltas: int = 1) -> bool:
+        """
+        Count newly saved deltas and check whether the session needs a snapshot
         
-        if last_snapshot:
-            deltas_since = self.db.query(SegmentationEdit).filter(
-                SegmentationEdit.segmentation_id == segmentation_id,
-                SegmentationEdit.session_id == session_id,
-                SegmentationEdit.edit_type == EditType.DELTA,
-                SegmentationEdit.created_at > last_snapshot.created_at
-            ).count()
+        Uses the session's running counters, and only counts deltas in the
+        database for a session that isn't tracked yet. Stays due until
+        create_snapshot resets the counters.
+        
+        Args:
+            segmentation_id: ID of segmentation
+            session_id: Collaborative session ID
+            new_deltas: Number of deltas just saved
             
-            time_since = (datetime.utcnow() - last_snapshot.created_at).total_seconds() / 60
+        Returns:
+            bool: True if a snapshot should be created
+        """
+        counts = session_counters.increment(session_id, new_deltas)
+        if counts is not None:
+            deltas_since, seconds_since = counts
         else:
-            # No snapshot yet, count all deltas
-            deltas_since = self.db.query(SegmentationEdit).filter(
-                SegmentationEdit.segmentation_id == segmentation_id,
-                SegmentationEdit.session_id == session_id,
-                SegmentationEdit.edit_type == EditType.DELTA
-            ).count()
-            
-            session = self.db.query(CollaborativeSession).get(session_id)
-            time_since = (datetime.utcnow() - session.started_at).total_seconds() / 60
+            deltas_since, seconds_since = self._count_since_snapshot(segmentation_id, session_id)
         
-        # Check if snapshot is needed
-        if self.delta_manager.should_create_snapshot(deltas_since, time_since):
-            # Reconstruct and save snapshot
-            reconstructed_data = self.reconstruct_from_deltas(segmentation_id, session_id)
-            
-            file_obj = BytesIO(reconstructed_data)
-            file_path = self.storage.save_file(
-                file_data=file_obj,
-                file_type='snapshot',
-                segmentation_id=segmentation_id
-            )
+        return self.delta_manager.should_create_snapshot(deltas_since, seconds_since)
+    
+    def create_snapshot(self, segmentation_id: int, session_id: int, user_id: int) -> SegmentationEdit:
+        """
+        Reconstruct the session's current state and save it as a snapshot
+        
+        Args:
+            segmentation_id: ID of segmentation
+            session_id: Collaborative session ID
+            user_id: ID of user the snapshot is attributed to
             
-            snapshot_edit = SegmentationEdit(
-                segmentation_id=segmentation_id,
-                edit_type=EditType.SNAPSHOT,
-                file_path=file_path,
-                data_size_bytes=len(reconstructed_data),
-                created_by_id=user_id,
-                session_id=session_id,
-                change_description="Automatic snapshot"
-            )
-            self.db.add(snapshot_edit)
-            self.db.commit()
+        Returns:
+            SegmentationEdit record of the snapshot
+        """
+        chunks = self.reconstruct_chunks(segmentation_id, session_id)
+        file_path, file_hash = self.store_file(
+            chunks,
+            file_type='snapshot',
+            segmentation_id=segmentation_id
+        )
+        
+        snapshot_edit = SegmentationEdit(
+            segmentation_id=segmentation_id,
+            edit_type=EditType.SNAPSHOT,
+            file_path=file_path,
+            file_hash=file_hash,
+            data_size_bytes=sum(map(len, chunks)),
+            created_by_id=user_id,
+            session_id=session_id,
+            change_description="Automatic snapshot"
+        )
+        self.db.add(snapshot_edit)
+        self.db.flush()
+        
+        # end_session holds this lock while it records the final version, so a
+        # snapshot finishing late can't point the segmentation back at an older state
+        session = self.db.get(
+            CollaborativeSession, session_id, with_for_update=True, populate_existing=True
+        )
+        if session is not None and session.status == SessionStatus.ACTIVE:
+            segmentation = self.db.get(Segmentation, segmentation_id)
+            segmentation.latest_full_save_edit_id = snapshot_edit.id
+            segmentation.latest_full_save_path = file_path
+        
+        self.db.commit()
+        session_counters.seed(session_id, 0)
+        return snapshot_edit
+    
+    def _count_since_snapshot(self, segmentation_id: int, session_id: int) -> Tuple[int, int]:
+        """
+        Count deltas and seconds since the session's last snapshot from the
+        database, and start tracking the session with those values
+        
+        Returns:
+            tuple: (deltas since last snapshot, seconds since last snapshot)
+        """
+        in_session = (
+            SegmentationEdit.segmentation_id == segmentation_id,
+            SegmentationEdit.session_id == session_id,
+        )
+        # Never correlated, so it still scans all edits when nested in the count below
+        snapshot_at_query = select(func.max(SegmentationEdit.created_at)).where(
+            *in_session, SegmentationEdit.edit_type == EditType.SNAPSHOT
+        ).correlate(None).scalar_subquery()
+        
+        # Last snapshot, session start, deltas since the snapshot and the database's
+        # own clock (the one every timestamp here came from) in one round-trip
+        last_snapshot_at, started_at, deltas_since, db_now = self.db.execute(select(
+            snapshot_at_query,
+            select(CollaborativeSession.started_at)
+            .where(CollaborativeSession.id == session_id).scalar_subquery(),
+            select(func.count()).select_from(SegmentationEdit).where(
+                *in_session,
+                SegmentationEdit.edit_type == EditType.DELTA,
+                or_(snapshot_at_query.is_(None), SegmentationEdit.created_at > snapshot_at_query)
+            ).scalar_subquery(),
+            func.now()
+        )).one()
+        
+        # No snapshot yet: count from the start of the session. The age is measured on
+        # the database clock, whatever its time zone, then anchored to ours
+        since = last_snapshot_at or started_at
+        seconds_since = max(0, int((db_now - since).total_seconds()))
+        session_counters.seed(session_id, deltas_since, now_epoch() - seconds_since)
+        return deltas_since, seconds_since
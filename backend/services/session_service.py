@@ -2,15 +2,16 @@ import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
+from sqlalchemy import and_, delete, exists, insert, or_, select
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime
-import json
 from models import (
     CollaborativeSession, SessionStatus, Segmentation,
-    User, SegmentationVersion
+    User, SegmentationVersion, session_participants
 )
 from .segmentation_service import SegmentationService
+from .delta_manager import session_counters
 
 
 class SessionService:
@@ -43,7 +44,7 @@ class SessionService:
             ValueError: If there's already an active session
         """
         # Check if segmentation exists
-        segmentation = self.db.query(Segmentation).get(segmentation_id)
+        segmentation = self.db.get(Segmentation, segmentation_id)
         if not segmentation:
             raise ValueError(f"Segmentation {segmentation_id} not found")
         
@@ -64,10 +65,12 @@ class SessionService:
             started_by_id=user_id,
             status=SessionStatus.ACTIVE,
             session_name=session_name,
-            participants_json=json.dumps([user_id])  # Creator is first participant
+            participants=[user_id]  # Creator is first participant
         )
         
         self.db.add(session)
+        self.db.flush()
+        self.db.execute(insert(session_participants).values(session_id=session.id, user_id=user_id))
         self.db.commit()
         self.db.refresh(session)
         
@@ -93,7 +96,11 @@ class SessionService:
         Raises:
             ValueError: If session not found or already ended
         """
-        session = self.db.query(CollaborativeSession).get(session_id)
+        # Held until the commit: a concurrent end waits and then sees ENDED, and a
+        # background snapshot can't move the latest-save pointer past the final version
+        session = self.db.get(
+            CollaborativeSession, session_id, with_for_update=True, populate_existing=True
+        )
         if not session:
             raise ValueError(f"Session {session_id} not found")
         
@@ -101,42 +108,46 @@ class SessionService:
             raise ValueError(f"Session {session_id} is not active")
         
         # Only session creator or participants can end it
-        participants = json.loads(session.participants_json or "[]")
-        if user_id != session.started_by_id and user_id not in participants:
+        if user_id != session.started_by_id and user_id not in session.participants:
             raise ValueError(f"User {user_id} cannot end this session")
         
+        # Ended in the same commit that points the segmentation at the final version
+        session.status = SessionStatus.ENDED
+        session.ended_at = datetime.utcnow()
+        
         # Create final version if requested
         final_version_id = None
         if create_final_version:
             from services.segmentation_service import SegmentationService
             seg_service = SegmentationService(self.db)
             
-            # Reconstruct final state from deltas
-            final_data = seg_service.reconstruct_from_deltas(
-                session.segmentation_id,
-                session_id
+            # Reconstruct final state from deltas, straight into storage - it is
+            # already a compressed .nrrd, so save_full_segmentation has nothing to add
+            file_path, file_hash = seg_service.store_file(
+                seg_service.reconstruct_chunks(session.segmentation_id, session_id),
+                file_type='nrrd',
+                segmentation_id=session.segmentation_id,
+                metadata={'user_id': user_id, 'type': 'full_save'}
             )
             
             # Save as final version
-            file_obj = BytesIO(final_data)
-            _, version = seg_service.save_full_segmentation(
+            _, version = seg_service.record_full_save(
                 segmentation_id=session.segmentation_id,
-                file_data=file_obj,
+                file_path=file_path,
                 user_id=user_id,
                 change_description=f"Final version from session: {session.session_name or session_id}",
                 create_version=True,
-                session_id=session_id
+                session_id=session_id,
+                file_hash=file_hash
             )
             
             final_version_id = version.id if version else None
         
-        # Update session
-        session.status = SessionStatus.ENDED
-        session.ended_at = datetime.utcnow()
         session.final_version_id = final_version_id
         
         self.db.commit()
         self.db.refresh(session)
+        session_counters.discard(session_id)
         
         return session
     
@@ -155,20 +166,17 @@ class SessionService:
         Returns:
             Updated CollaborativeSession record
         """
-        session = self.db.query(CollaborativeSession).get(session_id)
+        session = self.db.get(CollaborativeSession, session_id)
         if not session:
             raise ValueError(f"Session {session_id} not found")
         
         if session.status != SessionStatus.ACTIVE:
             raise ValueError(f"Cannot add participant to inactive session")
         
-        # Get current participants
-        participants = json.loads(session.participants_json or "[]")
-        
         # Add user if not already in list
-        if user_id not in participants:
-            participants.append(user_id)
-            session.participants_json = json.dumps(participants)
+        if user_id not in session.participants:
+            session.participants = session.participants + [user_id]
+            self.db.execute(insert(session_participants).values(session_id=session_id, user_id=user_id))
             self.db.commit()
             self.db.refresh(session)
         
@@ -189,7 +197,7 @@ class SessionService:
         Returns:
             Updated CollaborativeSession record
         """
-        session = self.db.query(CollaborativeSession).get(session_id)
+        session = self.db.get(CollaborativeSession, session_id)
         if not session:
             raise ValueError(f"Session {session_id} not found")
         
@@ -197,13 +205,13 @@ class SessionService:
         if user_id == session.started_by_id:
             raise ValueError("Cannot remove session creator")
         
-        # Get current participants
-        participants = json.loads(session.participants_json or "[]")
-        
         # Remove user if in list
-        if user_id in participants:
-            participants.remove(user_id)
-            session.participants_json = json.dumps(participants)
+        if user_id in session.participants:
+            session.participants = [pid for pid in session.participants if pid != user_id]
+            self.db.execute(delete(session_participants).where(
+                session_participants.c.session_id == session_id,
+                session_participants.c.user_id == user_id
+            ))
             self.db.commit()
             self.db.refresh(session)
         
@@ -234,14 +242,14 @@ class SessionService:
             )
         
         if user_id:
-            # Filter sessions where user is a participant
-            all_sessions = query.all()
-            filtered_sessions = []
-            for session in all_sessions:
-                participants = json.loads(session.participants_json or "[]")
-                if user_id in participants or user_id == session.started_by_id:
-                    filtered_sessions.append(session)
-            return filtered_sessions
+            # At most one participant row per session matches, so no duplicates
+            query = query.outerjoin(session_participants, and_(
+                session_participants.c.session_id == CollaborativeSession.id,
+                session_participants.c.user_id == user_id
+            )).filter(or_(
+                CollaborativeSession.started_by_id == user_id,
+                session_participants.c.user_id.isnot(None)
+            ))
         
         return query.all()
     
@@ -258,15 +266,13 @@ class SessionService:
         Returns:
             List of User records
         """
-        session = self.db.query(CollaborativeSession).get(session_id)
+        session = self.db.get(CollaborativeSession, session_id)
         if not session:
             raise ValueError(f"Session {session_id} not found")
         
-        participant_ids = json.loads(session.participants_json or "[]")
-        
-        return self.db.query(User).filter(
-            User.id.in_(participant_ids)
-        ).all()
+        return self.db.query(User).join(
+            session_participants, session_participants.c.user_id == User.id
+        ).filter(session_participants.c.session_id == session_id).all()
     
     def is_user_in_session(
         self,
@@ -283,11 +289,16 @@ class SessionService:
         Returns:
             bool: True if user is in session
         """
-        session = self.db.query(CollaborativeSession).get(session_id)
-        if not session:
-            return False
-        
-        participants = json.loads(session.participants_json or "[]")
-        return user_id in participants or user_id == session.started_by_id
+        # One existence probe; a missing session matches neither branch
+        return self.db.scalar(select(or_(
+            exists().where(
+                session_participants.c.session_id == session_id,
+                session_participants.c.user_id == user_id
+            ),
+            exists().where(
+                CollaborativeSession.id == session_id,
+                CollaborativeSession.started_by_id == user_id
+            )
+        )))
 
 